@@ -5,19 +5,24 @@ Above tools download posts from OnlyFans/Fansly and save metadata to 'user_data.
 This script requires python3, stashapp-tools, and sqlite3.
 """
 
+import base64
+import hashlib
 import json
 import os
 import random
 import re
 import shutil
+import socket
 import sqlite3
 import sys
 import tempfile
 import time
 import uuid
+from contextlib import redirect_stdout
 from datetime import datetime
+from functools import lru_cache
 from html import unescape
-from io import StringIO
+from io import BytesIO, StringIO
 from pathlib import Path
 from typing import Dict
 from urllib.parse import urlparse
@@ -43,6 +48,12 @@ except ModuleNotFoundError:
     )
     sys.exit()
 
+try:
+    from PIL import Image
+except ModuleNotFoundError:
+    # Optional, performer images are cached at their original size without it
+    Image = None
+
 # CONFIG ###########################################################################################
 
 # Default config
@@ -60,7 +71,13 @@ default_config = {
     "cache_time": 300,  # Image expiration time (in seconds).
     "cache_dir": "cache",  # Directory to store cached base64 encoded images.
     "cache_file": "cache.json",  # File to store cache information in.
+    "time_budget": 0,  # Seconds before optional lookups are skipped (0 to disable).
+    "path_map_time": 3600,  # Expiration time of prefetched scene/gallery paths (in seconds).
     "meta_base_path": None,  # Base path to search for 'user_data.db' files.
+    "catalog": None,  # Catalog file built with 'buildCatalog', searched before databases.
+    "fingerprint_index": None,  # Index built with 'buildFingerprints' to match renamed files.
+    "lease_time": 600,  # Seconds before the work of an unresponsive queue worker is retried.
+    "lease_attempts": 3,  # Maximum attempts for each creator database of a queue job.
     "direct_db": {
         "override": False,
         "db_format": None,
@@ -80,14 +97,18 @@ try:
         config = json.load(config_file)
 except FileNotFoundError:
     # If the file doesn't exist, use the default configuration
-    config = default_config
+    config = {}
 
 # Update config with missing keys
-config.update((k, v) for k, v in default_config.items() if k not in config)
+missing_keys = [k for k in default_config if k not in config]
+config.update((k, default_config[k]) for k in missing_keys)
 
-# Write config file
-with open("config.json", "w", encoding="utf-8") as config_file:
-    json.dump(config, config_file, indent=2)
+# Write config file, only when keys were added and in one step, as scrapes run concurrently
+if missing_keys:
+    config_temp_path = f"config.json.{os.getpid()}.tmp"
+    with open(config_temp_path, "w", encoding="utf-8") as config_file:
+        json.dump(config, config_file, indent=2)
+    os.replace(config_temp_path, "config.json")
 
 STASH_CONNECTION = config["stash_connection"]
 MAX_TITLE_LENGTH = config["max_title_length"]
@@ -98,7 +119,13 @@ META_BASE_PATH = config["meta_base_path"]
 CACHE_TIME = config["cache_time"]
 CACHE_DIR = config["cache_dir"]
 CACHE_FILE = config["cache_file"]
+TIME_BUDGET = config["time_budget"]
+PATH_MAP_TIME = config["path_map_time"]
 DIRECT_DB = config["direct_db"]
+CATALOG = config["catalog"]
+FINGERPRINT_INDEX = config["fingerprint_index"]
+LEASE_TIME = config["lease_time"]
+LEASE_ATTEMPTS = config["lease_attempts"]
 
 
 def convert_datetime(val):
@@ -122,14 +149,56 @@ Markdown.output_formats["plain"] = unmark_element
 __md = Markdown(output_format="plain")
 __md.stripTopLevelTags = False
 
+# Patterns used to normalize post text, compiled once
+HTML_TAG_PATTERN = re.compile(r"<[^>]*>")
+MENTION_PATTERN = re.compile(r"(?:^|\s)@([\w\-\.]+)")
+ALPHANUMERIC_PATTERN = re.compile(r"[A-Za-z0-9]")
+# Anything Markdown could parse, the first line of text without it is left unchanged
+MARKDOWN_SYNTAX_PATTERN = re.compile(
+    r"[*_`\[\]\\<>&#|~\t\x02\x03]|^ *(?:[-+=]|\d+[.)])|^ {4}", re.MULTILINE
+)
+# Maximum width and height of cached performer images (requires Pillow)
+PERFORMER_IMAGE_SIZE = 1024
+# Number of post texts to memoize, posts with multiple media share the same text
+TEXT_CACHE_SIZE = 4096
+
+
+# BUDGET ###########################################################################################
+START_TIME = time.monotonic()
+skipped_stages = []
+
+
+def within_budget(stage):
+    """
+    Log the runtime after a stage and return whether the time budget still has time left.
+    """
+    elapsed = time.monotonic() - START_TIME
+    log.debug(f"Script runtime at {stage}: {elapsed} seconds")
+    return not TIME_BUDGET or elapsed < TIME_BUDGET
+
+
+def skip_stage(stage):
+    """
+    Record an optional stage that was skipped because the time budget is spent.
+    """
+    if stage not in skipped_stages:
+        log.warning(f"[BUDGET] Time budget of {TIME_BUDGET}s spent, skipping {stage}")
+        skipped_stages.append(stage)
+
 
 # STASH ############################################################################################
-try:
-    stash = StashInterface(STASH_CONNECTION)
-except SystemExit:
-    log.error("Unable to connect to Stash, please verify your config.")
-    print("null")
-    sys.exit()
+# Commands that only read the metadata databases and don't need Stash
+OFFLINE_COMMANDS = ["buildCatalog", "buildFingerprints", "queueJob", "queueStatus"]
+
+if sys.argv[1:2] and sys.argv[1] in OFFLINE_COMMANDS:
+    stash = None
+else:
+    try:
+        stash = StashInterface(STASH_CONNECTION)
+    except SystemExit:
+        log.error("Unable to connect to Stash, please verify your config.")
+        print("null")
+        sys.exit()
 
 # CACHE  ###########################################################################################
 # Create cache directory
@@ -171,19 +240,98 @@ def save_cache(cache):
         log.info("[CACHE UPDATED]")
 
 
+def get_directory_memo_path(directory):
+    """
+    Return the memo file path used for a media directory.
+    """
+    digest = hashlib.sha1(str(directory).encode("utf-8")).hexdigest()
+    return Path(CACHE_DIR) / f"{digest}.memo.json"
+
+
+def load_directory_memo(directory, db):
+    """
+    Load the image metadata memo for a directory, discarding it when it is stale
+    or was built from a different (or since modified) database.
+    """
+    memo_path = get_directory_memo_path(directory)
+    try:
+        with open(memo_path, "r", encoding="utf-8") as file:
+            memo = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if (
+        time.time() - memo.get("timestamp", 0) > CACHE_TIME
+        or memo.get("db") != str(db)
+        or memo.get("db_mtime") != Path(db).stat().st_mtime
+    ):
+        log.info(f"[MEMO PURGE] Purging stale memo for directory: {directory}")
+        memo_path.unlink(missing_ok=True)
+        return None
+    return memo.get("rows", {})
+
+
+def get_memoized_db(directory):
+    """
+    Return the database a memo of the directory was built from, or None without a fresh memo.
+
+    Following images of a memoized directory reuse it instead of searching for the database.
+    """
+    try:
+        with open(get_directory_memo_path(directory), "r", encoding="utf-8") as file:
+            memo = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if time.time() - memo.get("timestamp", 0) > CACHE_TIME or not Path(memo["db"]).is_file():
+        return None
+    log.debug(f"[MEMO HIT] Using memoized database for directory: {directory}")
+    return Path(memo["db"])
+
+
+def save_directory_memo(directory, db, rows):
+    """
+    Save the image metadata memo for a directory and purge stale memos of other directories.
+    """
+    current_time = time.time()
+    for memo_path in Path(CACHE_DIR).glob("*.memo.json"):
+        try:
+            if current_time - memo_path.stat().st_mtime > CACHE_TIME:
+                log.debug(f"[MEMO PURGE] Deleting stale memo from disk: {memo_path}")
+                memo_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    memo = {
+        "timestamp": current_time,
+        "db": str(db),
+        "db_mtime": Path(db).stat().st_mtime,
+        "rows": rows,
+    }
+    # written aside and swapped in, concurrent scrapes never read a partial memo
+    memo_path = get_directory_memo_path(directory)
+    temp_path = memo_path.with_name(f"{memo_path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(memo, file)
+    os.replace(temp_path, memo_path)
+    log.info(f"[MEMO UPDATED] {len(rows)} file(s) for directory: {directory}")
+
+
 # SCENES ###########################################################################################
-def lookup_scene(file, db, media_dir, username, network):
+def lookup_scene(file, db, media_dir, username, network, db_conn=None):
     """
     Query database for scene metadata and create a structured scrape result.
+
+    The database is loaded into memory unless it is already loaded (db_conn).
     """
     sqlite3.register_converter("timestamp", convert_datetime)
     sqlite3.register_converter("created_at", convert_datetime)
     log.info(f"Using database: {db} for {file}")
-    conn = load_db_into_memory(db)
+    conn = db_conn if db_conn is not None else load_db_into_memory(db)
+    within_budget("db load")
     c = conn.cursor()
 
-    c.execute(
-        """
+    filename = file.name
+    query = """
         SELECT medias.filename, medias.post_id, match.api_type
         FROM medias
         JOIN (
@@ -194,12 +342,19 @@ def lookup_scene(file, db, media_dir, username, network):
         ON medias.post_id = match.post_id
         WHERE medias.media_type = 'Videos'
         ORDER BY medias.id ASC
-    """,
-        (file.name,),
-    )
+    """
+    c.execute(query, (filename,))
 
     result = c.fetchall()
 
+    if not result:
+        # the file may have been renamed after it was downloaded
+        match = find_fingerprint_match(file, username, network)
+        if match:
+            filename = match[1]
+            c.execute(query, (filename,))
+            result = c.fetchall()
+
     if not result:
         log.error(f"Could not find metadata for scene: {file}")
         print("null")
@@ -217,7 +372,7 @@ def lookup_scene(file, db, media_dir, username, network):
             WHERE posts.post_id = medias.post_id
             AND medias.filename = ?
         """
-        c.execute(query, (file.name,))
+        c.execute(query, (filename,))
     else:
         log.error(f"Unknown api_type {api_type} for post: {post_id}")
         # print("null")
@@ -225,7 +380,7 @@ def lookup_scene(file, db, media_dir, username, network):
 
     log.debug(f"Found {len(result)} video(s) in post {post_id}")
     if len(result) > 1:
-        scene_index = [item[0] for item in result].index(file.name) + 1
+        scene_index = [item[0] for item in result].index(filename) + 1
         scene_count = len(result)
         log.debug(f"Video is {scene_index} of {len(result)} in post")
     else:
@@ -258,62 +413,55 @@ def lookup_scene(file, db, media_dir, username, network):
                 )
                 AND medias.filename = ?;
             """
-            c.execute(query, (file.name,))
+            c.execute(query, (filename,))
             row = c.fetchone()
     except Exception as e:
         log.error(
             f"The {db} is an old schema and {post_id} doesn't have any data in the {api_type} table.\n {e}"
         )
 
-    scene = process_row(row, username, network, file.name, scene_index, scene_count)
-    # log.debug(f'Date is: {scene["date"]}')
-    scrape = {
-        "title": scene["title"],
-        "details": scene["details"],
-        "date": scene["date"],
-        "code": scene["code"],
-        "urls": scene["urls"],
-        "studio": get_studio_info(username, network),
-    }
-    scrape["Performers"] = []
-    # parse usernames
-    usernames = searchPerformers(scrape)
-    usernames.append(username)
-    log.debug(f"{usernames=}")
-    for name in list(set(usernames)):
-        name = name.strip(".")  # remove trailing full stop
-        scrape["Performers"].append({"Name": getnamefromalias(name)})
+    within_budget("sql")
 
-    if api_type == "Messages" and TAG_MESSAGES:
-        scrape["tags"] = [{"name": TAG_MESSAGES_NAME}]
+    scene = process_row(row, username, network, filename, scene_index, scene_count)
+    scrape = build_scrape(scene, username, network, api_type)
 
-    conn.close()
+    if db_conn is None:
+        conn.close()
 
     return scrape
 
 
 # GALLERIES ########################################################################################
-def lookup_gallery(file, db, media_dir, username, network):
+def lookup_gallery(file, db, media_dir, username, network, db_conn=None):
     """
     Query database for gallery metadata and create a structured scrape result.
+
+    The database is loaded into memory unless it is already loaded (db_conn).
     """
     sqlite3.register_converter("timestamp", convert_datetime)
     sqlite3.register_converter("created_at", convert_datetime)
     log.info(f"Using database: {db} for {file}")
-    conn = load_db_into_memory(db)
+    conn = db_conn if db_conn is not None else load_db_into_memory(db)
+    within_budget("db load")
     c = conn.cursor()
     # which media type should we look up for our file?
     log.info(str(file.resolve()))
-    c.execute(
-        """
+    query = """
         SELECT DISTINCT api_type, post_id
         FROM medias
         WHERE medias.directory = ?
         COLLATE NOCASE
-    """,
-        (str(file.resolve()),),
-    )
+    """
+    c.execute(query, (str(file.resolve()),))
     row = c.fetchone()
+    if not row and file.is_dir():
+        # the directory may have been renamed, match on the files it contains
+        for media_file in sorted(child for child in file.iterdir() if child.is_file())[:5]:
+            match = find_fingerprint_match(media_file, username, network)
+            if match:
+                c.execute(query, (match[0],))
+                row = c.fetchone()
+                break
     if not row:
         log.error(f"Could not find metadata for gallery: {file}")
         print("null")
@@ -334,29 +482,409 @@ def lookup_gallery(file, db, media_dir, username, network):
         print("null")
         sys.exit()
 
-    gallery = process_row(c.fetchone(), username, network)
+    row = c.fetchone()
+    within_budget("sql")
+    if row is None:
+        log.error(f"Could not find post {post_id} in the {api_type} table for gallery: {file}")
+        print("null")
+        sys.exit()
 
-    scrape = {
-        "title": gallery["title"],
-        "details": gallery["details"],
-        "date": gallery["date"],
-        "urls": gallery["urls"],
-        "studio": get_studio_info(username, network),
-    }
-    scrape["Performers"] = []
-    # parse usernames
-    usernames = searchPerformers(scrape)
-    log.debug(f"{usernames=}")
-    for name in list(set(usernames)):
-        name = name.strip(".")  # remove trailing full stop
-        scrape["Performers"].append({"Name": getnamefromalias(name)})
+    gallery = process_row(row + (None, None), username, network, "")
+    scrape = build_scrape(gallery, username, network, api_type, gallery=True)
 
-    if api_type == "Messages" and TAG_MESSAGES:
-        scrape["tags"] = [{"name": TAG_MESSAGES_NAME}]
+    if db_conn is None:
+        conn.close()
+
+    return scrape
+
+
+def get_profile_path(username, network):
+    """
+    Return the profile cache file path used for a creator.
+    """
+    digest = hashlib.sha1(f"{network}/{username}".lower().encode("utf-8")).hexdigest()
+    return Path(CACHE_DIR) / f"{digest}.profile.json"
+
+
+def load_profile(username, network):
+    """
+    Load the cached profile of a creator, or None.
+    """
+    try:
+        with open(get_profile_path(username, network), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_profile(profile):
+    """
+    Save the profile of a creator, replacing the previous one in a single step.
+    """
+    profile_path = get_profile_path(profile["username"], profile["network"])
+    temp_path = profile_path.with_name(f"{profile_path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(profile, file)
+    os.replace(temp_path, profile_path)
+    log.info(f"[PROFILE UPDATED] {profile['username']} ({profile['network']})")
+
+
+def get_directory_fingerprint(directory):
+    """
+    Return the latest modification time of a directory and its direct subdirectories,
+    with a hash of the files of its 'Profile' directory (searched recursively for images).
+    """
+    directory = Path(directory)
+    mtimes = [directory.stat().st_mtime_ns]
+    digest = hashlib.sha1()
+    for child in sorted(directory.iterdir()):
+        if child.is_dir():
+            mtimes.append(child.stat().st_mtime_ns)
+            if child.name.lower() == "profile":
+                for entry in sorted(child.rglob("*")):
+                    stat = entry.stat()
+                    digest.update(
+                        f"{entry.relative_to(child)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode()
+                    )
+    return f"{max(mtimes)}:{digest.hexdigest()}"
+
+
+def get_path_map_path():
+    """
+    Return the path of the prefetched scene/gallery path map.
+    """
+    return Path(CACHE_DIR) / "paths.db"
+
+
+def prefetch_paths(page_size=1000):
+    """
+    Fetch the paths of all scenes and galleries from Stash in pages and store them
+    in the path map, so bulk scrapes don't have to query Stash for every path.
+    """
+    path_map = get_path_map_path()
+    temp_path = path_map.with_name(f"{path_map.name}.{os.getpid()}.tmp")
+    conn = sqlite3.connect(temp_path)
+    try:
+        conn.execute("DROP TABLE IF EXISTS paths")
+        conn.execute(
+            """
+            CREATE TABLE paths (kind TEXT, id TEXT, path TEXT, PRIMARY KEY (kind, id))
+            WITHOUT ROWID
+        """
+        )
+        for kind, find, fragment in (
+            ("scene", stash.find_scenes, "id files { path }"),
+            ("gallery", stash.find_galleries, "id folder { path }"),
+        ):
+            page, fetched = 1, 0
+            while True:
+                count, items = find(
+                    filter={"page": page, "per_page": page_size, "sort": "id"},
+                    fragment=fragment,
+                    get_count=True,
+                )
+                rows = []
+                for item in items:
+                    if kind == "scene" and item.get("files"):
+                        rows.append((kind, str(item["id"]), item["files"][0]["path"]))
+                    elif kind == "gallery" and (item.get("folder") or {}).get("path"):
+                        rows.append((kind, str(item["id"]), item["folder"]["path"]))
+                conn.executemany("INSERT OR REPLACE INTO paths VALUES (?, ?, ?)", rows)
+                fetched += len(items)
+                log.debug(f"[PATHS] Fetched {fetched} of {count} {kind} path(s)")
+                if not items or fetched >= count:
+                    break
+                page += 1
+            log.info(f"[PATHS] Prefetched {fetched} {kind} path(s)")
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(temp_path, path_map)
+
+
+def get_prefetched_path(kind, item_id):
+    """
+    Return the prefetched path of a scene or gallery, or None when it is not
+    prefetched or the path map has expired.
+    """
+    path_map = get_path_map_path()
+    try:
+        if time.time() - path_map.stat().st_mtime > PATH_MAP_TIME:
+            return None
+    except FileNotFoundError:
+        return None
+    conn = sqlite3.connect(f"{path_map.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        row = conn.execute(
+            "SELECT path FROM paths WHERE kind = ? AND id = ?", (kind, str(item_id))
+        ).fetchone()
+    except sqlite3.DatabaseError as e:
+        log.warning(f"Unable to read prefetched paths: {e}")
+        row = None
+    finally:
+        conn.close()
+    if row:
+        log.debug(f"[PATHS] Using prefetched path for {kind} {item_id}")
+        return row[0]
+    return None
+
+
+# IMAGES ###########################################################################################
+def lookup_image(file, db, media_dir, username, network):
+    """
+    Query the directory memo (or database) for image metadata and create a structured scrape result.
+    """
+    directory = file.parent.resolve()
+    rows = load_directory_memo(directory, db)
+    if rows is None or file.name not in rows:
+        log.info(f"Using database: {db} for {file}")
+        rows = query_directory_images(directory, file.name, db)
+        save_directory_memo(directory, db, rows)
+    else:
+        log.debug(f"[MEMO HIT] Using memoized metadata for directory: {directory}")
+
+    image = rows.get(file.name)
+    if not image:
+        # the file may have been renamed after it was downloaded
+        match = find_fingerprint_match(file, username, network)
+        if match:
+            image = query_directory_images(Path(match[0]), match[1], db).get(match[1])
+            if image:
+                rows[file.name] = image
+                save_directory_memo(directory, db, rows)
+    if not image:
+        log.error(f"Could not find metadata for image: {file}")
+        print("null")
+        sys.exit()
+
+    row = (
+        image["post_id"],
+        image["text"],
+        image["created_at"],
+        image["link"],
+        image["linked"],
+    )
+    result = process_row(
+        row, username, network, file.name, image["index"], image["count"]
+    )
+    return build_scrape(result, username, network, image["api_type"])
+
+
+def query_directory_images(directory, filename, db):
+    """
+    Resolve post metadata for every media file in a directory with a single database load.
+
+    The requested filename is also matched on its own in case the stored directory
+    does not match the path known to Stash. Files without metadata are kept as None
+    so repeated lookups for them do not reload the database.
+    """
+    sqlite3.register_converter("timestamp", convert_datetime)
+    sqlite3.register_converter("created_at", convert_datetime)
+    conn = load_db_into_memory(db)
+    within_budget("db load")
+    c = conn.cursor()
+
+    c.execute(
+        """
+        SELECT medias.filename, medias.post_id, medias.api_type, medias.media_type,
+        medias.link, medias.linked
+        FROM medias
+        WHERE medias.directory = ? COLLATE NOCASE
+        OR medias.filename = ?
+        ORDER BY medias.id ASC
+    """,
+        (str(directory), filename),
+    )
+    medias = c.fetchall()
+
+    # group post ids per table so each table is queried once
+    post_ids = {}
+    for media in medias:
+        api_type = sanitize_api_type(media[2])
+        post_ids.setdefault(api_type, set()).add(media[1])
+
+    posts = {}
+    for api_type, ids in post_ids.items():
+        if api_type not in ("Posts", "Stories", "Messages", "Products", "Others"):
+            log.error(f"Unknown api_type {api_type} for post(s): {ids}")
+            continue
+        ids = list(ids)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            query = f"""
+                SELECT posts.post_id, posts.text, posts.created_at
+                FROM {api_type.lower()} AS posts
+                WHERE posts.post_id IN ({", ".join("?" * len(chunk))})
+            """
+            c.execute(query, chunk)
+            for post_id, text, created_at in c.fetchall():
+                if isinstance(created_at, datetime):
+                    created_at = created_at.isoformat()
+                posts[(api_type, post_id)] = (text or "", created_at)
 
     conn.close()
+    within_budget("sql")
+
+    # number images within their post, like videos are for scenes
+    post_images = {}
+    for media in medias:
+        if media[3] == "Images":
+            post_images.setdefault(media[1], []).append(media[0])
+
+    rows = {filename: None}
+    for media_filename, post_id, api_type, media_type, link, linked in medias:
+        api_type = sanitize_api_type(api_type)
+        post = posts.get((api_type, post_id))
+        if post is None:
+            continue
+        images = post_images.get(post_id, [])
+        if len(images) > 1 and media_filename in images:
+            index, count = images.index(media_filename) + 1, len(images)
+        else:
+            index, count = 0, 0
+        rows[media_filename] = {
+            "post_id": post_id,
+            "api_type": api_type,
+            "text": post[0],
+            "created_at": post[1],
+            "link": link,
+            "linked": linked,
+            "index": index,
+            "count": count,
+        }
+    return rows
+
+
+# PERFORMERS #######################################################################################
+def search_performer(name):
+    """
+    Find the creators matching a name and return them as performer search results.
+    """
+    username = name.strip().lstrip("@")
+    results = []
+    for network, creator_dir in find_creator_dirs(username):
+        profile = load_profile(username, network) or {}
+        results.append(
+            {
+                "name": profile.get("username", creator_dir.name),
+                "urls": get_network_urls(creator_dir.name, network),
+            }
+        )
+    return results
 
-    return scrape
+
+def scrape_performer(fragment):
+    """
+    Resolve a performer fragment to a creator and return their profile as performer.
+    """
+    username = fragment.get("name", "").strip().lstrip("@")
+    urls = " ".join(fragment.get("urls") or [fragment.get("url") or ""]).lower()
+    if "fansly.com" in urls:
+        networks = ["Fansly"]
+    elif "onlyfans.com" in urls:
+        networks = ["OnlyFans"]
+    else:
+        networks = ["OnlyFans", "Fansly"]
+
+    for network in networks:
+        creator_dirs = find_creator_dirs(username, network)
+        if creator_dirs:
+            creator_dir = creator_dirs[0][1]
+            return get_performer_info(creator_dir.name, network, creator_dir)
+
+    log.error(f"Could not find a creator directory for performer: {username}")
+    return None
+
+
+def find_creator_dirs(username, network=None):
+    """
+    Find the directories of a creator as (network, directory) tuples.
+
+    Uses the cached profiles first, then the catalog, then searches 'meta_base_path'.
+    """
+    networks = [network] if network else ["OnlyFans", "Fansly"]
+    creator_dirs = []
+    for network in networks:
+        profile = load_profile(username, network)
+        if profile and Path(profile["creator_dir"]).is_dir():
+            creator_dirs.append((network, Path(profile["creator_dir"])))
+    if creator_dirs:
+        return creator_dirs
+
+    conn = open_catalog() if CATALOG else None
+    if conn is not None:
+        sources = conn.execute(
+            "SELECT path FROM sources WHERE username = ? COLLATE NOCASE",
+            (username,),
+        ).fetchall()
+        conn.close()
+        for (path,) in sources:
+            path_info = find_path_info(Path(path))
+            if path_info and path_info[1] in networks and path_info[2].is_dir():
+                creator_dirs.append((path_info[1], path_info[2]))
+        if creator_dirs:
+            return creator_dirs
+
+    if not META_BASE_PATH:
+        log.error("Set 'meta_base_path' or 'catalog' to find performer directories")
+        return creator_dirs
+    search_path = Path(META_BASE_PATH).resolve()
+    for network in networks:
+        try:
+            found = search_path.rglob(f"{network}/{username}", case_sensitive=False)
+            found = list(found)
+        except TypeError:
+            found = list(search_path.rglob(f"{network}/{username}"))
+        creator_dirs += [(network, path) for path in found if path.is_dir()]
+    return creator_dirs
+
+
+def get_network_urls(username, network):
+    """
+    Return the profile URLs of a creator.
+    """
+    if network == "OnlyFans":
+        return [f"https://onlyfans.com/{username}"]
+    if network == "Fansly":
+        return [f"https://fansly.com/{username}"]
+    return []
+
+
+def select_profile_images(creator_dir):
+    """
+    Find the avatar and header images saved by the downloaders, avatar first.
+    """
+    image_list = []
+    for child in Path(creator_dir).iterdir():
+        if child.is_dir() and child.name.lower() == "profile":
+            image_list += [
+                image
+                for image in child.rglob("*")
+                if image.suffix.lower() in (".jpg", ".jpeg", ".png")
+            ]
+    return sorted(
+        image_list,
+        key=lambda image: ("avatar" not in image.name.lower(), image.name.lower()),
+    )[:MAX_PERFORMER_IMAGES]
+
+
+def encode_performer_image(image):
+    """
+    Encode an image to base64, downscaled to PERFORMER_IMAGE_SIZE when Pillow is installed.
+    """
+    if Image is None:
+        return file_to_base64(image)
+    try:
+        with Image.open(image) as img:
+            if max(img.size) <= PERFORMER_IMAGE_SIZE:
+                return file_to_base64(image)
+            img.thumbnail((PERFORMER_IMAGE_SIZE, PERFORMER_IMAGE_SIZE))
+            buffer = BytesIO()
+            img.convert("RGB").save(buffer, format="JPEG", quality=90)
+    except OSError as e:
+        log.warning(f"Unable to resize image {image}: {e}")
+        return file_to_base64(image)
+    return f"data:image/jpeg;base64,{base64.b64encode(buffer.getvalue()).decode()}"
 
 
 # UTILS ############################################################################################
@@ -364,9 +892,13 @@ def get_scene_path(scene_id):
     """
     Find and return the path for a scene by its ID.
     """
-    scene = stash.find_scene(scene_id)
+    path = get_prefetched_path("scene", scene_id)
+    if path:
+        return path
+
+    scene = stash.find_scene(scene_id, fragment="files { path }")
     # log.debug(scene)
-    if scene:
+    if scene and scene["files"]:
         return scene["files"][0]["path"]
 
     log.error(f"Path for scene {scene_id} could not be found")
@@ -376,6 +908,9 @@ def get_scene_path(scene_id):
 
 # alias search
 def getnamefromalias(alias):
+    if not within_budget("alias resolution"):
+        skip_stage("alias resolution")
+        return alias
     perfs = stash.find_performers(
         f={"aliases": {"value": alias, "modifier": "EQUALS"}},
         filter={"page": 1, "per_page": 5},
@@ -391,7 +926,11 @@ def get_gallery_path(gallery_id):
     """
     Find and return the path for a gallery by its ID.
     """
-    gallery = stash.find_gallery(gallery_id)
+    path = get_prefetched_path("gallery", gallery_id)
+    if path:
+        return path
+
+    gallery = stash.find_gallery(gallery_id, fragment="folder { path }")
     # log.debug(gallery)
     if gallery:
         if gallery.get("folder", None):
@@ -403,27 +942,92 @@ def get_gallery_path(gallery_id):
     sys.exit()
 
 
-def get_performer_info(username, media_dir):
+def get_image_path(image_id):
     """
-    Resolve performer based on username
+    Find and return the path for an image by its ID.
     """
-    req = stash.find_performer(username)
-    log.debug(f"found performer(s): {req}")
+    image = stash.find_image(
+        image_id, fragment="visual_files { ... on BaseFile { path } }"
+    )
+    # log.debug(image)
+    if image:
+        files = image.get("visual_files") or image.get("files")
+        if files and files[0].get("path", None):
+            return files[0]["path"]
+
+    log.error(f"Path for image {image_id} could not be found")
+    print("null")
+    sys.exit()
+
+
+def get_performer_info(username, network, media_dir):
+    """
+    Resolve performer based on username, from the profile cache when the creator
+    directory did not change since the profile was built
+    """
+    fingerprint = get_directory_fingerprint(media_dir)
+    profile = load_profile(username, network)
+    if (
+        profile
+        and profile["creator_dir"] == str(media_dir)
+        and profile["fingerprint"] == fingerprint
+    ):
+        log.debug(f"[PROFILE HIT] Using cached profile for: {username} ({network})")
+        if not profile["stored_id"] and within_budget("performer resolution"):
+            # the performer may have been created since the profile was built
+            profile["stored_id"] = find_performer_id(username)
+            if profile["stored_id"]:
+                save_profile(profile)
+    else:
+        log.debug(f"[PROFILE MISS] Building profile for: {username} ({network})")
+        profile = {
+            "username": username,
+            "network": network,
+            "creator_dir": str(media_dir),
+            "fingerprint": fingerprint,
+            "urls": get_network_urls(username, network),
+            "stored_id": None,
+            "images": [],
+        }
+        if within_budget("performer resolution"):
+            profile["stored_id"] = find_performer_id(username)
+        else:
+            skip_stage("performer resolution")
+        if within_budget("performer images"):
+            images = select_profile_images(media_dir)
+            if images:
+                profile["images"] = [encode_performer_image(image) for image in images]
+            else:
+                profile["images"] = get_performer_images(media_dir) or []
+        else:
+            skip_stage("performer images")
+        # a partial profile is returned but not cached
+        if not skipped_stages:
+            save_profile(profile)
+
     res: Dict = {}
-    if req:
-        log.debug(f"Found performer id: {req['id']}")
-        res["stored_id"] = req["id"]
+    if profile["stored_id"]:
+        res["stored_id"] = profile["stored_id"]
     res["name"] = username
+    res["urls"] = profile["urls"]
+    if profile["images"]:
+        res["images"] = profile["images"]
+    return res
 
-    images = get_performer_images(media_dir)
-    if images is not None:
-        res["images"] = images
 
-    return [res]
+def find_performer_id(username):
+    """
+    Find the ID of the Stash performer matching a username, or None
+    """
+    req = stash.find_performer(username, fragment="id name")
+    log.debug(f"found performer(s): {req}")
+    if req:
+        log.debug(f"Found performer id: {req['id']}")
+        return req["id"]
+    return None
 
 
 def searchPerformers(scene):
-    pattern = re.compile(r"(?:^|\s)@([\w\-\.]+)")
     content = unescape(scene["details"])
     # if title is truncated, remove trailing dots and skip searching title
     if scene["title"].endswith("..") and scene["title"].removesuffix("..") in content:
@@ -431,7 +1035,7 @@ def searchPerformers(scene):
     else:
         # if title is unique, search title and content
         searchtext = scene["title"] + " " + content
-    usernames = re.findall(pattern, unescape(searchtext))
+    usernames = MENTION_PATTERN.findall(unescape(searchtext))
     return usernames
 
 
@@ -439,22 +1043,26 @@ def get_studio_info(studio_name, studio_network):
     """
     Resolve studio based on name and network
     """
-    req = stash.find_studios(
-        f={
-            "name": {
-                "value": f"{studio_name} ({studio_network})",
-                "modifier": "EQUALS",
-            },
-            "OR": {
-                "aliases": {
+    req = []
+    if within_budget("studio resolution"):
+        req = stash.find_studios(
+            f={
+                "name": {
                     "value": f"{studio_name} ({studio_network})",
                     "modifier": "EQUALS",
-                }
+                },
+                "OR": {
+                    "aliases": {
+                        "value": f"{studio_name} ({studio_network})",
+                        "modifier": "EQUALS",
+                    }
+                },
             },
-        },
-        filter={"page": 1, "per_page": 5},
-        fragment="id, name, aliases",
-    )
+            filter={"page": 1, "per_page": 5},
+            fragment="id, name, aliases",
+        )
+    else:
+        skip_stage("studio resolution")
     log.debug(f"found studio(s): {req}")
     res: Dict = {"parent": {}}
     if len(req) == 1:
@@ -516,7 +1124,7 @@ def get_performer_images(path):
             [CACHE MISS] Encoding {index + 1} of {len(selected_images)} image(s) to base64: {image}'
         """
         )
-        base64_data = file_to_base64(image)
+        base64_data = encode_performer_image(image)
         if base64_data is None:
             log.error(f"Error converting image to base64: {image}")
             print("null")
@@ -544,6 +1152,24 @@ def remove_markdown_in_title(title):
     return __md.convert(title)
 
 
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def get_title_line(text):
+    """
+    Sanitize the post text and return its first line without markdown.
+
+    The markdown parser is skipped when the text contains no markdown syntax.
+    """
+    text = sanitize_string(text)
+    # line endings are normalized the same way as by the parser
+    plain = text.replace("\r\n", "\n").replace("\r", "\n")
+    if MARKDOWN_SYNTAX_PATTERN.search(plain):
+        text = remove_markdown_in_title(text)
+    else:
+        # the parser would only drop leading blank lines
+        text = plain.strip()
+    return text.split("\n")[0].strip()
+
+
 def truncate_title(title, max_length):
     """
     Truncate title to provided maximum length while preserving word boundaries.
@@ -569,17 +1195,13 @@ def format_title(title, username, date, scene_index, scene_count):
         scene_info = f" ({scene_index})" if scene_index > 0 else ""
         return f"{username} - {date}{scene_info}"
 
-    title = sanitize_string(title)
-
-    title = remove_markdown_in_title(title)
-
-    f_title = truncate_title(title.split("\n")[0].strip(), MAX_TITLE_LENGTH)
+    f_title = truncate_title(get_title_line(title), MAX_TITLE_LENGTH)
     scene_info = f" ({scene_index})" if scene_index > 0 else ""
 
     if len(f_title) <= 5:
         return f"{f_title} - {date}{scene_info}"
 
-    if not bool(re.search("[A-Za-z0-9]", f_title)):
+    if not ALPHANUMERIC_PATTERN.search(f_title):
         if scene_index == 0:
             title_max_len = MAX_TITLE_LENGTH - 13
         else:
@@ -644,16 +1266,15 @@ def process_row(row, username, network, filename, scene_index=0, scene_count=0):
     """
     Process a database row and format post details.
     """
-    if row[1] is None:
-        row[1] = ""
+    text = row[1] or ""
     date = row[2]
     if validate_datetime(date):
         date = datetime.fromisoformat(date)
 
     res = {}
     res["date"] = date.strftime("%Y-%m-%d")
-    res["title"] = format_title(row[1], username, res["date"], scene_index, scene_count)
-    res["details"] = sanitize_string(row[1])
+    res["title"] = format_title(text, username, res["date"], scene_index, scene_count)
+    res["details"] = sanitize_string(text)
     try:
         res["code"] = parse_row_to_studio_code(row)
     except ValueError:
@@ -665,6 +1286,37 @@ def process_row(row, username, network, filename, scene_index=0, scene_count=0):
     return res
 
 
+def build_scrape(result, username, network, api_type, gallery=False):
+    """
+    Create a structured scrape result from a processed row, with studio, performers and tags.
+
+    Galleries have no code, and only the performers mentioned in the post.
+    """
+    scrape = {
+        "title": result["title"],
+        "details": result["details"],
+        "date": result["date"],
+        "urls": result["urls"],
+        "studio": get_studio_info(username, network),
+    }
+    if not gallery:
+        scrape["code"] = result["code"]
+    scrape["Performers"] = []
+    # parse usernames
+    usernames = searchPerformers(scrape)
+    if not gallery:
+        usernames.append(username)
+    log.debug(f"{usernames=}")
+    for name in list(set(usernames)):
+        name = name.strip(".")  # remove trailing full stop
+        scrape["Performers"].append({"Name": getnamefromalias(name)})
+
+    if api_type == "Messages" and TAG_MESSAGES:
+        scrape["tags"] = [{"name": TAG_MESSAGES_NAME}]
+
+    return scrape
+
+
 def get_metadata_db(search_path, username, network):
     """
     Recursively search for 'user_data.db' file starting from 'search_path'
@@ -703,6 +1355,9 @@ def get_metadata_db(search_path, username, network):
             return db_files[0]
 
         search_path = search_path.parent
+        if not within_budget("db discovery"):
+            log.error("Time budget spent while searching for the metadata database")
+            break
     log.error(
         f"Unable to find matadata file for pattern '{network}/**/{username}/**/user_data.db' in '{search_path}'"
     )
@@ -714,6 +1369,18 @@ def get_path_info(path):
     """
     Extract the username and network from a given path
     """
+    path_info = find_path_info(path)
+    if path_info is None:
+        log.error(f"Could not find username or network in path: {path}")
+        print("null")
+        sys.exit(1)
+    return path_info
+
+
+def find_path_info(path):
+    """
+    Extract the username, network and creator directory from a given path, or None
+    """
     network = "Fansly" if "Fansly" in str(path) else "OnlyFans"
     try:
         path_parts = [item.lower() for item in path.parts]
@@ -732,9 +1399,7 @@ def get_path_info(path):
             return path.parts[index + 1], network, Path(*path.parts[: index + 2])
         raise ValueError
     except ValueError:
-        log.error(f"Could not find username or network in path: {path}")
-        print("null")
-        sys.exit(1)
+        return None
 
 
 def validate_datetime(timestamp):
@@ -778,63 +1443,1121 @@ def sanitize_api_type(api_type):
     return api_type
 
 
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
 def sanitize_string(string):
     """
     Parses and sanitizes strings to remove HTML tags
     """
     if string:
         string = unescape(string).replace("<br /> ", "\n")
-        string = re.sub(r"<[^>]*>", "", string)
+        string = HTML_TAG_PATTERN.sub("", string)
         return string
     return string
 
 
+# Columns read by the lookups, nothing else is loaded from the metadata database
+DB_PROJECTIONS = {
+    "medias": (
+        "id",
+        "filename",
+        "directory",
+        "post_id",
+        "api_type",
+        "media_type",
+        "link",
+        "linked",
+        "size",
+    ),
+    "posts": ("post_id", "text", "created_at"),
+    "stories": ("post_id", "text", "created_at"),
+    "messages": ("post_id", "text", "created_at"),
+    "products": ("post_id", "text", "created_at"),
+    "others": ("post_id", "text", "created_at"),
+}
+# Indexes created on the projected tables, for the columns the lookups filter on
+DB_PROJECTION_INDEXES = {
+    "medias": ("filename", "directory COLLATE NOCASE", "post_id"),
+    "posts": ("post_id",),
+    "stories": ("post_id",),
+    "messages": ("post_id",),
+    "products": ("post_id",),
+    "others": ("post_id",),
+}
+
+
+def copy_db_projections(mem_conn: sqlite3.Connection, source_uri: str):
+    """
+    Attach the source database and copy the DB_PROJECTIONS columns into the main database.
+
+    Rows are copied with INSERT ... SELECT so they are streamed by SQLite itself,
+    without materializing them in Python, then the DB_PROJECTION_INDEXES are created.
+    Tables or columns missing from older schemas are created empty (NULL) so the lookup
+    queries keep working.
+    """
+    mem_conn.execute("ATTACH DATABASE ? AS source", (source_uri,))
+    try:
+        for table, columns in DB_PROJECTIONS.items():
+            source_columns = {
+                row[1].lower(): row[2]
+                for row in mem_conn.execute(f"PRAGMA source.table_info({table})")
+            }
+            definitions = ", ".join(
+                f"{column} {source_columns.get(column, '')}".strip() for column in columns
+            )
+            mem_conn.execute(f"CREATE TABLE main.{table} ({definitions})")
+            if not source_columns:
+                log.debug(f"Table {table} not found in database, leaving it empty")
+                continue
+            selection = ", ".join(
+                column if column in source_columns else "NULL" for column in columns
+            )
+            mem_conn.execute(
+                f"""
+                INSERT INTO main.{table} ({", ".join(columns)})
+                SELECT {selection} FROM source.{table}
+            """
+            )
+        # the source indexes are not copied, they are created once the rows are loaded
+        for table, columns in DB_PROJECTION_INDEXES.items():
+            for index, column in enumerate(columns):
+                mem_conn.execute(f"CREATE INDEX main.{table}_{index} ON {table} ({column})")
+        mem_conn.commit()
+    finally:
+        mem_conn.execute("DETACH DATABASE source")
+
+
 def load_db_into_memory(db_file: str) -> sqlite3.Connection:
     """
-    Copied the db_file into a temporary directory (for faster access),
-    incase the file is on a network drive.
+    Loads the columns used for scraping (DB_PROJECTIONS) into an in-memory database.
 
-    Dumps the full db into SQL commands
+    The db_file is opened read-only in place, so tables and columns that are never
+    read (e.g. large blobs or JSON stored by some downloaders) are not loaded.
 
-    Loads the SQL commands into an in-memory database
+    If the file can't be read in place (e.g. locking on some network drives), it is
+    copied into a temporary directory and loaded from there instead.
     """
+    # Connect to an in-memory database
+    mem_conn = sqlite3.connect(
+        ":memory:",
+        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        uri=True,
+    )
+    try:
+        copy_db_projections(mem_conn, f"{Path(db_file).resolve().as_uri()}?mode=ro")
+        return mem_conn
+    except sqlite3.OperationalError as e:
+        log.warning(f"Unable to read {db_file} in place, using a local copy: {e}")
+        mem_conn.close()
+
+    mem_conn = sqlite3.connect(
+        ":memory:",
+        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        uri=True,
+    )
     # Create a temporary directory to store the local copy of the database
     with tempfile.TemporaryDirectory() as temp_dir:
-        local_db_path = os.path.join(temp_dir, os.path.basename(db_file))
+        local_db_path = Path(temp_dir) / os.path.basename(db_file)
         # Copy the database file from the network drive to the local path
         shutil.copy(db_file, local_db_path)
+        copy_db_projections(mem_conn, f"{local_db_path.as_uri()}?mode=ro")
+
+    return mem_conn  # Return the in-memory connection
+
+
+# CATALOG ##########################################################################################
+CATALOG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sources (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE,
+        network TEXT,
+        username TEXT,
+        size INTEGER,
+        mtime_ns INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS posts (
+        source_id INTEGER,
+        api_type TEXT,
+        post_id INTEGER,
+        text TEXT,
+        created_at TEXT,
+        PRIMARY KEY (source_id, post_id, api_type)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS medias (
+        source_id INTEGER,
+        media_order INTEGER,
+        filename TEXT,
+        directory TEXT,
+        relative_directory TEXT,
+        post_id INTEGER,
+        api_type TEXT,
+        media_type TEXT,
+        link TEXT,
+        linked TEXT
+    );
+    CREATE INDEX IF NOT EXISTS medias_filename ON medias (filename);
+    CREATE INDEX IF NOT EXISTS medias_directory ON medias (directory COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS medias_relative_directory
+    ON medias (relative_directory COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS medias_post ON medias (source_id, post_id);
+"""
+# Version of the catalog schema, older catalogs are rebuilt
+CATALOG_VERSION = 1
+
+
+def build_catalog(catalog_path, search_path):
+    """
+    Merge every 'user_data.db' found under search_path into a single catalog file.
+
+    Only databases whose size or modification time changed since the previous build
+    are reloaded, and databases that disappeared are removed from the catalog.
+    The catalog is updated in a temporary copy which then replaces it, so readers
+    never see a partially written catalog.
+    """
+    sqlite3.register_converter("timestamp", convert_datetime)
+    sqlite3.register_converter("created_at", convert_datetime)
+    catalog_path = Path(catalog_path)
+    temp_path = catalog_path.with_name(f"{catalog_path.name}.{os.getpid()}.tmp")
+    if catalog_path.is_file():
+        shutil.copy(catalog_path, temp_path)
+
+    conn = sqlite3.connect(temp_path)
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+            conn.executescript(
+                "DROP TABLE IF EXISTS medias; DROP TABLE IF EXISTS posts; "
+                "DROP TABLE IF EXISTS sources;"
+            )
+        conn.executescript(CATALOG_SCHEMA)
+        conn.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+        sources = {
+            path: (source_id, size, mtime_ns)
+            for source_id, path, size, mtime_ns in conn.execute(
+                "SELECT id, path, size, mtime_ns FROM sources"
+            )
+        }
+
+        discovered = find_metadata_dbs(search_path)
+
+        changed = 0
+        for path in set(sources) - set(discovered):
+            log.info(f"[CATALOG] Removing missing database: {path}")
+            delete_catalog_source(conn, sources[path][0])
+            changed += 1
+
+        for path, (username, network, _) in discovered.items():
+            stat = Path(path).stat()
+            source = sources.get(path)
+            if source and source[1:] == (stat.st_size, stat.st_mtime_ns):
+                log.debug(f"[CATALOG] Unchanged database: {path}")
+                continue
+            if source:
+                delete_catalog_source(conn, source[0])
+            log.info(f"[CATALOG] Adding database: {path}")
+            source_id = conn.execute(
+                """
+                INSERT INTO sources (path, network, username, size, mtime_ns)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                (path, network, username, stat.st_size, stat.st_mtime_ns),
+            ).lastrowid
+            add_catalog_source(conn, source_id, path)
+            changed += 1
+
+        conn.commit()
+        if changed:
+            conn.execute("VACUUM")
+        count = conn.execute("SELECT COUNT(*) FROM medias").fetchone()[0]
+    finally:
+        conn.close()
+
+    os.replace(temp_path, catalog_path)
+    log.info(
+        f"[CATALOG] {catalog_path}: {len(discovered)} database(s), "
+        f"{changed} updated, {count} media file(s)"
+    )
+
+
+def find_metadata_dbs(search_path):
+    """
+    Find every 'user_data.db' under search_path, mapped to its (username, network, media_dir).
+    """
+    discovered = {}
+    for db_file in Path(search_path).resolve().rglob("user_data.db"):
+        path_info = find_path_info(db_file)
+        if path_info is None:
+            log.warning(f"Could not find username or network for: {db_file}")
+            continue
+        discovered[str(db_file)] = path_info
+    return discovered
+
+
+def delete_catalog_source(conn, source_id):
+    """
+    Remove a source database and its rows from the catalog.
+    """
+    conn.execute("DELETE FROM medias WHERE source_id = ?", (source_id,))
+    conn.execute("DELETE FROM posts WHERE source_id = ?", (source_id,))
+    conn.execute("DELETE FROM sources WHERE id = ?", (source_id,))
+
+
+def add_catalog_source(conn, source_id, db_file):
+    """
+    Copy the media files and posts of a metadata database into the catalog.
+    """
+    db_conn = load_db_into_memory(db_file)
+    try:
+        for api_type in ("Posts", "Stories", "Messages", "Products", "Others"):
+            conn.executemany(
+                "INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        source_id,
+                        api_type,
+                        post_id,
+                        text or "",
+                        created_at.isoformat()
+                        if isinstance(created_at, datetime)
+                        else created_at,
+                    )
+                    for post_id, text, created_at in db_conn.execute(
+                        f"SELECT post_id, text, created_at FROM {api_type.lower()}"
+                    )
+                ),
+            )
+        medias = db_conn.execute(
+            """
+            SELECT id, filename, directory, post_id, api_type, media_type, link, linked
+            FROM medias
+        """
+        )
+        relative_directories = {}
+        for media in medias:
+            directory = media[2]
+            if directory not in relative_directories:
+                relative_directories[directory] = get_relative_directory(directory)
+            conn.execute(
+                "INSERT INTO medias VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    source_id,
+                    *media[:3],
+                    relative_directories[directory],
+                    media[3],
+                    sanitize_api_type(media[4]),
+                    *media[5:],
+                ),
+            )
+    finally:
+        db_conn.close()
+
+
+def get_relative_directory(directory):
+    """
+    Return a directory relative to its creator directory ('<network>/<username>'), which is
+    the same on every host whatever the library is mounted on, or None.
+    """
+    if not directory:
+        return None
+    path_info = find_path_info(Path(directory))
+    if path_info is None:
+        return None
+    return "/".join(Path(directory).parts[len(path_info[2].parts) :])
+
+
+def open_catalog():
+    """
+    Open the catalog read-only and memory mapped, without locking (it is replaced, never modified).
+    """
+    catalog_path = Path(CATALOG).resolve()
+    if not catalog_path.is_file():
+        log.error(f"The catalog {catalog_path} doesn't exist")
+        return None
+    conn = sqlite3.connect(f"{catalog_path.as_uri()}?mode=ro&immutable=1", uri=True)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+        log.error(f"The catalog {catalog_path} is outdated, build it again with 'buildCatalog'")
+        conn.close()
+        return None
+    conn.execute(f"PRAGMA mmap_size = {max(catalog_path.stat().st_size, 1 << 20)}")
+    return conn
+
+
+def lookup_catalog(file, action):
+    """
+    Query the catalog for scene, gallery or image metadata and create a structured scrape result.
+
+    Returns None when the file is not in the catalog.
+    """
+    conn = open_catalog()
+    if conn is None:
+        return None
+    c = conn.cursor()
+    columns = """
+        SELECT sources.network, sources.username, medias.source_id, medias.post_id,
+        medias.api_type, medias.link, medias.linked, medias.filename
+        FROM medias JOIN sources ON sources.id = medias.source_id
+    """
+    # the library may be mounted elsewhere than on the host that built the catalog,
+    # so files are matched within their creator, on the directory relative to it
+    path_info = find_path_info(file)
+    if path_info is None:
+        creator, creator_params = "", ()
+    else:
+        creator = "AND sources.network = ? AND sources.username = ? COLLATE NOCASE"
+        creator_params = (path_info[1], path_info[0])
+    directory = file if action == "queryGallery" else file.parent
+    relative_directory = get_relative_directory(str(directory))
+
+    if action == "queryGallery":
+        if relative_directory is not None:
+            c.execute(
+                f"""
+                {columns} WHERE medias.relative_directory = ? COLLATE NOCASE {creator}
+                LIMIT 1
+            """,
+                (relative_directory, *creator_params),
+            )
+        else:
+            c.execute(
+                f"{columns} WHERE medias.directory = ? COLLATE NOCASE LIMIT 1",
+                (str(file.resolve()),),
+            )
+        media_type = None
+    else:
+        # the same filename may exist in several directories, prefer the matching one
+        c.execute(
+            f"""
+            {columns} WHERE medias.filename = ? {creator}
+            ORDER BY (medias.relative_directory = ? COLLATE NOCASE) DESC,
+            (medias.directory = ? COLLATE NOCASE) DESC
+            LIMIT 1
+        """,
+            (file.name, *creator_params, relative_directory, str(directory.resolve())),
+        )
+        media_type = "Videos" if action == "queryScene" else "Images"
+    media = c.fetchone()
+    if not media:
+        log.info(f"Could not find {file} in the catalog")
+        conn.close()
+        return None
+    network, username, source_id, post_id, api_type, link, linked, filename = media
+
+    c.execute(
+        """
+        SELECT text, created_at FROM posts
+        WHERE source_id = ? AND post_id = ?
+        ORDER BY (api_type = ?) DESC LIMIT 1
+    """,
+        (source_id, post_id, api_type),
+    )
+    post = c.fetchone()
+    if not post:
+        log.info(f"Could not find post {post_id} for {file} in the catalog")
+        conn.close()
+        return None
 
-        # Connect to the local copy of the database file
-        disk_conn = sqlite3.connect(
-            local_db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
+    index, count = 0, 0
+    if media_type:
+        c.execute(
+            """
+            SELECT filename FROM medias
+            WHERE source_id = ? AND post_id = ? AND media_type = ?
+            ORDER BY media_order ASC
+        """,
+            (source_id, post_id, media_type),
         )
+        filenames = [row[0] for row in c.fetchall()]
+        if len(filenames) > 1 and filename in filenames:
+            index, count = filenames.index(filename) + 1, len(filenames)
+    conn.close()
+    within_budget("catalog lookup")
+
+    row = (post_id, post[0], post[1], link, linked)
+    result = process_row(row, username, network, filename, index, count)
+    return build_scrape(result, username, network, api_type, gallery=media_type is None)
+
+
+# FINGERPRINTS #####################################################################################
+# Size of each of the chunks hashed (at the start, middle and end of a file)
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024
+# Version of the fingerprint index schema, older indexes are rebuilt
+FINGERPRINT_INDEX_VERSION = 2
+# Extensions of the files fingerprinted in the media trees
+MEDIA_EXTENSIONS = ".mp4 .m4v .mov .mkv .webm .avi .wmv .flv .ts .jpg .jpeg .png .gif .webp".split()
+
+
+def get_file_fingerprint(path, size=None):
+    """
+    Fingerprint a file from its size and a hash of a few sampled chunks.
+    """
+    if size is None:
+        size = Path(path).stat().st_size
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for offset in sorted({0, size // 2, max(0, size - FINGERPRINT_SAMPLE_SIZE)}):
+            file.seek(offset)
+            digest.update(file.read(FINGERPRINT_SAMPLE_SIZE))
+    return f"{size}:{digest.hexdigest()}"
+
+
+def build_fingerprint_index(index_path, search_path):
+    """
+    Fingerprint the media trees of every 'user_data.db' under search_path, and store the
+    fingerprint of each download with its original directory and filename.
+
+    Only files whose size or modification time changed since the previous build are
+    hashed again. Downloads whose original file no longer exists keep their fingerprint,
+    or are paired with a renamed file of the same size left in their directory.
+    """
+    conn = sqlite3.connect(index_path)
+    try:
+        create_fingerprint_tables(conn)
+        indexed = {
+            path: (size, mtime_ns, fingerprint)
+            for path, size, mtime_ns, fingerprint in conn.execute("SELECT * FROM files")
+        }
+        fingerprints, counts = {}, {"hashed": 0, "downloads": 0, "renamed": 0}
+        for db_file, (username, network, media_dir) in find_metadata_dbs(search_path).items():
+            creator_counts = index_creator_downloads(
+                conn, db_file, username, network, media_dir, indexed, fingerprints
+            )
+            for key, count in creator_counts.items():
+                counts[key] += count
+            conn.commit()
+
+        removed = set(indexed) - set(fingerprints)
+        conn.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in removed))
+        conn.commit()
+    finally:
+        conn.close()
+    log.info(
+        f"[FINGERPRINTS] {index_path}: {len(fingerprints)} file(s), {counts['hashed']} hashed, "
+        f"{counts['downloads']} download(s) updated, {counts['renamed']} renamed file(s) paired"
+    )
+
+
+def create_fingerprint_tables(conn):
+    """
+    Create the tables of the fingerprint index, dropping the ones of an older version.
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] != FINGERPRINT_INDEX_VERSION:
+        conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS downloads;")
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            fingerprint TEXT
+        );
+        CREATE TABLE IF NOT EXISTS downloads (
+            network TEXT,
+            username TEXT,
+            directory TEXT,
+            filename TEXT,
+            fingerprint TEXT,
+            renamed INTEGER,
+            PRIMARY KEY (network, username, directory, filename, fingerprint)
+        );
+        CREATE INDEX IF NOT EXISTS downloads_fingerprint ON downloads (fingerprint);
+        PRAGMA user_version = {FINGERPRINT_INDEX_VERSION};
+    """
+    )
+
+
+def index_creator_downloads(conn, db_file, username, network, media_dir, indexed, fingerprints):
+    """
+    Fingerprint the media tree of a creator and update the fingerprints of its downloads.
 
+    Returns the number of files hashed, downloads updated and renamed files paired.
+    """
+    db_conn = load_db_into_memory(db_file)
+    try:
+        medias = db_conn.execute(
+            """
+            SELECT DISTINCT directory, filename, size FROM medias
+            WHERE directory IS NOT NULL AND filename IS NOT NULL
+        """
+        ).fetchall()
+    finally:
+        db_conn.close()
+    counts = {"hashed": 0, "downloads": 0, "renamed": 0}
+
+    # files of the media tree that are not a download at its original path
+    originals = {os.path.join(directory, filename) for directory, filename, _ in medias}
+    walked = walk_media_files(media_dir, {media[0] for media in medias})
+    counts["hashed"] += fingerprint_files(conn, walked | originals, indexed, fingerprints)
+    unmatched = {}
+    for path in walked - originals:
+        if path in fingerprints:
+            unmatched.setdefault(os.path.dirname(path), []).append(path)
+
+    downloads = load_downloads(conn, username, network)
+    missing = {}
+    for directory, filename, size in medias:
+        fingerprint = fingerprints.get(os.path.join(directory, filename))
+        if fingerprint:
+            if save_download(
+                conn, downloads, username, network, directory, filename, fingerprint
+            ):
+                counts["downloads"] += 1
+        else:
+            missing.setdefault(directory, []).append((filename, size))
+
+    for directory, filename, fingerprint in pair_renamed_files(
+        missing, unmatched, downloads, fingerprints
+    ):
+        if save_download(
+            conn, downloads, username, network, directory, filename, fingerprint, renamed=True
+        ):
+            counts["downloads"] += 1
+            counts["renamed"] += 1
+    return counts
+
+
+def fingerprint_files(conn, paths, indexed, fingerprints):
+    """
+    Fingerprint files into fingerprints, reusing the indexed fingerprint of the ones that
+    didn't change. Files that don't exist or can't be read are left out.
+
+    Returns the number of files hashed.
+    """
+    hashed = 0
+    for path in paths:
+        if path in fingerprints:
+            continue
         try:
-            # Dump the database into SQL commands
-            dump_commands = "".join([f"{line}\n" for line in disk_conn.iterdump()])
-        finally:
-            disk_conn.close()
-
-        # Connect to an in-memory database
-        mem_conn = sqlite3.connect(
-            ":memory:", detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
+            stat = os.stat(path)
+            cached = indexed.get(path)
+            if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                fingerprints[path] = cached[2]
+                continue
+            fingerprints[path] = get_file_fingerprint(path, stat.st_size)
+        except OSError:
+            continue
+        conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, fingerprints[path]),
+        )
+        hashed += 1
+    return hashed
+
+
+def load_downloads(conn, username, network):
+    """
+    Return the indexed fingerprints of the downloads of a creator, as
+    {(directory, filename): {fingerprint: renamed}}.
+    """
+    downloads = {}
+    for directory, filename, fingerprint, renamed in conn.execute(
+        "SELECT directory, filename, fingerprint, renamed FROM downloads "
+        "WHERE network = ? AND username = ?",
+        (network, username),
+    ):
+        downloads.setdefault((directory, filename), {})[fingerprint] = bool(renamed)
+    return downloads
+
+
+def save_download(
+    conn, downloads, username, network, directory, filename, fingerprint, renamed=False
+):
+    """
+    Store the fingerprint of a download, and return whether it changed.
+
+    The fingerprint of the original file replaces the previous ones, the fingerprint of a
+    renamed (or remuxed) file paired with it once the original is gone is added to them.
+    """
+    known = downloads.setdefault((directory, filename), {})
+    if known == {fingerprint: renamed} or (renamed and fingerprint in known):
+        return False
+    if not renamed:
+        conn.execute(
+            "DELETE FROM downloads "
+            "WHERE network = ? AND username = ? AND directory = ? AND filename = ?",
+            (network, username, directory, filename),
+        )
+        known.clear()
+    conn.execute(
+        "INSERT INTO downloads VALUES (?, ?, ?, ?, ?, ?)",
+        (network, username, directory, filename, fingerprint, renamed),
+    )
+    known[fingerprint] = renamed
+    return True
+
+
+def pair_renamed_files(missing, unmatched, downloads, fingerprints):
+    """
+    Pair the downloads whose original file is missing with the single unmatched file of the
+    same size left in their directory.
+
+    Files with a fingerprint already stored for a download are that download (renamed or
+    moved), and are never paired with another one.
+
+    Returns the (directory, filename, fingerprint) of each new pairing.
+    """
+    known = {fingerprint for download in downloads.values() for fingerprint in download}
+    pairs = []
+    for directory, files in missing.items():
+        candidates = unmatched.get(directory) or unmatched.get(
+            str(Path(directory).resolve()), []
+        )
+        candidates = [path for path in candidates if fingerprints[path] not in known]
+        for filename, size in files:
+            if downloads.get((directory, filename)) or not size:
+                continue
+            same_size = [path for path in candidates if os.path.getsize(path) == size]
+            if len(same_size) == 1:
+                pairs.append((directory, filename, fingerprints[same_size[0]]))
+                candidates.remove(same_size[0])
+    return pairs
+
+
+def walk_media_files(media_dir, directories):
+    """
+    List the media files (by extension) of a creator media tree (except its 'Metadata'
+    directory), and of the download directories outside of it.
+    """
+    files = set()
+    for root, dirnames, filenames in os.walk(media_dir):
+        dirnames[:] = [dirname for dirname in dirnames if dirname.lower() != "metadata"]
+        files.update(
+            os.path.join(root, filename)
+            for filename in filenames
+            if os.path.splitext(filename)[1].lower() in MEDIA_EXTENSIONS
+        )
+    media_dir = Path(media_dir).resolve()
+    for directory in directories:
+        path = Path(directory)
+        if path.is_dir() and not path.resolve().is_relative_to(media_dir):
+            files.update(
+                str(child)
+                for child in path.iterdir()
+                if child.suffix.lower() in MEDIA_EXTENSIONS and child.is_file()
+            )
+    return files
+
+
+def find_fingerprint_match(file, username, network):
+    """
+    Find the download with the same content as file, for files renamed or moved after
+    they were downloaded. Downloads with the fingerprint of their original file are
+    preferred over renamed files paired with them by size.
+
+    Returns the (directory, filename) stored in the metadata database, or None when no
+    download or several downloads match.
+    """
+    if not FINGERPRINT_INDEX or not Path(FINGERPRINT_INDEX).is_file():
+        return None
+    conn = sqlite3.connect(f"{Path(FINGERPRINT_INDEX).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != FINGERPRINT_INDEX_VERSION:
+            log.error(
+                f"The fingerprint index {FINGERPRINT_INDEX} is outdated, "
+                "build it again with 'buildFingerprints'"
+            )
+            return None
+        stat = file.stat()
+        # files of the media trees were fingerprinted when the index was built
+        row = conn.execute(
+            "SELECT fingerprint FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (str(file), stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        fingerprint = row[0] if row else get_file_fingerprint(file, stat.st_size)
+        rows = conn.execute(
+            """
+            SELECT DISTINCT directory, filename, renamed FROM downloads
+            WHERE fingerprint = ? AND network = ? AND username = ? COLLATE NOCASE
+            ORDER BY renamed
+        """,
+            (fingerprint, network, username),
+        ).fetchall()
+    except (OSError, sqlite3.Error) as e:
+        log.warning(f"Unable to fingerprint {file}: {e}")
+        return None
+    finally:
+        conn.close()
+    # renamed files are only matched when no original file has the same fingerprint
+    matches = [row[:2] for row in rows if row[2] == rows[0][2]]
+    if len(matches) > 1:
+        log.warning(f"[FINGERPRINTS] {file} matches {len(matches)} downloads, skipping")
+        return None
+    if matches:
+        log.info(f"[FINGERPRINTS] Matched {file} to {Path(*matches[0])}")
+        return matches[0]
+    return None
+
+
+# QUEUE ############################################################################################
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    id INTEGER PRIMARY KEY,
+    db_path TEXT UNIQUE,
+    username TEXT,
+    network TEXT,
+    media_dir TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    expires_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    action TEXT,
+    path TEXT,
+    lease_id INTEGER,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    finished_at REAL,
+    PRIMARY KEY (action, path)
+);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    started_at REAL,
+    last_seen REAL,
+    leases INTEGER NOT NULL DEFAULT 0,
+    items INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    busy_time REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS results_lease ON results (lease_id);
+"""
+# Seconds between two checks for leases while other workers still hold some
+QUEUE_POLL_TIME = 10
+
+
+def open_queue(queue_path):
+    """
+    Open (and create) a queue file, with explicit transactions so leases are claimed atomically.
+    """
+    conn = sqlite3.connect(queue_path, timeout=60, isolation_level=None)
+    conn.executescript(QUEUE_SCHEMA)
+    return conn
+
+
+def create_queue_job(queue_path, search_path):
+    """
+    Add a lease for every 'user_data.db' under search_path that isn't in the queue yet.
+    """
+    conn = open_queue(queue_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        added = 0
+        for db_file, (username, network, media_dir) in find_metadata_dbs(search_path).items():
+            added += conn.execute(
+                """
+                INSERT OR IGNORE INTO leases (db_path, username, network, media_dir)
+                VALUES (?, ?, ?, ?)
+            """,
+                (db_file, username, network, str(media_dir)),
+            ).rowcount
+        conn.execute("COMMIT")
+        total = conn.execute("SELECT COUNT(*) FROM leases").fetchone()[0]
+    finally:
+        conn.close()
+    log.info(f"[QUEUE] {queue_path}: {added} lease(s) added, {total} in total")
+
+
+def claim_lease(conn, worker):
+    """
+    Claim the next pending or expired lease, or return None when there is none.
+
+    Leases that expired LEASE_ATTEMPTS times (their workers crashed or hung) are failed.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            """
+            UPDATE leases SET status = 'failed', error = 'Lease expired ' || attempts || ' time(s)'
+            WHERE status = 'leased' AND expires_at < ? AND attempts >= ?
+        """,
+            (now, LEASE_ATTEMPTS),
+        )
+        lease = conn.execute(
+            """
+            SELECT id, db_path, username, network, media_dir FROM leases
+            WHERE status = 'pending' OR (status = 'leased' AND expires_at < ?)
+            ORDER BY attempts, id LIMIT 1
+        """,
+            (now,),
+        ).fetchone()
+        if lease:
+            conn.execute(
+                """
+                UPDATE leases SET status = 'leased', worker = ?, expires_at = ?,
+                attempts = attempts + 1
+                WHERE id = ?
+            """,
+                (worker, now + LEASE_TIME, lease[0]),
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return lease
+
+
+def save_lease_progress(conn, lease_id, worker, results, stats, status="leased", error=None):
+    """
+    Write the results of a lease back to the queue, renew (or close) the lease and
+    update the worker statistics.
+
+    Returns False, without writing anything, when the lease expired and was claimed by
+    another worker.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        renewed = conn.execute(
+            """
+            UPDATE leases SET status = ?, expires_at = ?, error = ?
+            WHERE id = ? AND worker = ? AND status = 'leased'
+        """,
+            (status, now + LEASE_TIME, error, lease_id, worker),
+        ).rowcount
+        if not renewed:
+            conn.execute("ROLLBACK")
+            return False
+        conn.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((*result, lease_id, worker, *outcome, now) for result, outcome in results),
+        )
+        conn.execute(
+            """
+            INSERT INTO workers VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (worker) DO UPDATE SET
+            last_seen = excluded.last_seen,
+            leases = leases + excluded.leases,
+            items = items + excluded.items,
+            misses = misses + excluded.misses,
+            busy_time = busy_time + excluded.busy_time
+        """,
+            (
+                worker,
+                stats["started_at"],
+                now,
+                stats["leases"],
+                len(results),
+                stats["misses"],
+                stats["busy_time"],
+            ),
         )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    results.clear()
+    stats.update(leases=0, misses=0, busy_time=0)
+    return True
+
+
+def get_lease_items(conn, lease_id, db_conn):
+    """
+    List the scenes (videos) and galleries (image directories) of a lease that exist on disk
+    and don't have a result yet (from a previous attempt).
+    """
+    done = set(conn.execute("SELECT action, path FROM results WHERE lease_id = ?", (lease_id,)))
+    medias = db_conn.execute(
+        """
+        SELECT DISTINCT directory, filename, media_type FROM medias
+        WHERE directory IS NOT NULL AND media_type IN ('Videos', 'Images')
+        ORDER BY id
+    """
+    ).fetchall()
+    items = {}
+    for directory, filename, media_type in medias:
+        if media_type == "Videos" and filename:
+            items[("queryScene", str(Path(directory) / filename))] = None
+        elif media_type == "Images":
+            items[("queryGallery", directory)] = None
+    return [item for item in items if item not in done and Path(item[1]).exists()]
 
-        # Execute the dump commands to recreate the database in memory
-        mem_conn.executescript(dump_commands)
 
-        return mem_conn  # Return the in-memory connection
+def run_worker(queue_path):
+    """
+    Claim leases from a queue until every lease is done or failed, scraping the scenes and
+    galleries of each creator database and writing the results back to the queue.
+    """
+    global START_TIME
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    conn = open_queue(queue_path)
+    stats = {"started_at": time.time(), "leases": 0, "misses": 0, "busy_time": 0}
+    lookups = {"queryScene": lookup_scene, "queryGallery": lookup_gallery}
+    log.info(f"[QUEUE] Worker {worker} started")
+    try:
+        while True:
+            lease = claim_lease(conn, worker)
+            if lease is None:
+                remaining = conn.execute(
+                    "SELECT COUNT(*) FROM leases WHERE status IN ('pending', 'leased')"
+                ).fetchone()[0]
+                if not remaining:
+                    break
+                # wait for the other workers, or for their leases to expire
+                time.sleep(QUEUE_POLL_TIME)
+                continue
+
+            lease_id, db_path, username, network, media_dir = lease
+            log.info(f"[QUEUE] Lease {lease_id}: {username} ({network})")
+            results = []
+            db_conn = None
+            try:
+                # loaded once for every item of the lease
+                db_conn = load_db_into_memory(db_path)
+                items = get_lease_items(conn, lease_id, db_conn)
+            except Exception as e:
+                log.error(f"[QUEUE] Lease {lease_id}: unable to read {db_path}: {e}")
+                if db_conn is not None:
+                    db_conn.close()
+                attempts = conn.execute(
+                    "SELECT attempts FROM leases WHERE id = ?", (lease_id,)
+                ).fetchone()[0]
+                status = "failed" if attempts >= LEASE_ATTEMPTS else "pending"
+                if not save_lease_progress(
+                    conn, lease_id, worker, results, stats, status, str(e)
+                ):
+                    log.warning(
+                        f"[QUEUE] Lease {lease_id} expired and was claimed by another worker"
+                    )
+                continue
+
+            last_save, lost = time.monotonic(), False
+            try:
+                for action, path in items:
+                    START_TIME = time.monotonic()
+                    skipped_stages.clear()
+                    try:
+                        # lookups print null and exit when nothing matches
+                        with redirect_stdout(StringIO()):
+                            media = lookups[action](
+                                Path(path), db_path, Path(media_dir), username, network, db_conn
+                            )
+                        outcome = (json.dumps(media), None)
+                    except SystemExit:
+                        outcome = (None, "Not found")
+                        stats["misses"] += 1
+                    except Exception as e:
+                        log.error(f"[QUEUE] Unable to scrape {path}: {e}")
+                        outcome = (None, str(e))
+                        stats["misses"] += 1
+                    stats["busy_time"] += time.monotonic() - START_TIME
+                    results.append(((action, path), outcome))
+
+                    if time.monotonic() - last_save > LEASE_TIME / 4:
+                        if not save_lease_progress(conn, lease_id, worker, results, stats):
+                            lost = True
+                            break
+                        last_save = time.monotonic()
+            finally:
+                db_conn.close()
+
+            if lost:
+                log.warning(f"[QUEUE] Lease {lease_id} expired and was claimed by another worker")
+                continue
+            stats["leases"] += 1
+            if save_lease_progress(conn, lease_id, worker, results, stats, "done"):
+                log.info(f"[QUEUE] Lease {lease_id}: {len(items)} item(s) done")
+            else:
+                log.warning(f"[QUEUE] Lease {lease_id} expired and was claimed by another worker")
+    finally:
+        conn.close()
+    log.info(f"[QUEUE] Worker {worker} finished, no leases left")
+
+
+def print_queue_status(queue_path):
+    """
+    Print the progress of a queue job and the throughput of its workers.
+    """
+    conn = open_queue(queue_path)
+    try:
+        leases = dict(conn.execute("SELECT status, COUNT(*) FROM leases GROUP BY status"))
+        found, missing = conn.execute(
+            "SELECT COUNT(result), COUNT(*) - COUNT(result) FROM results"
+        ).fetchone()
+        workers = conn.execute(
+            """
+            SELECT worker, leases, items, misses, busy_time, last_seen - started_at, last_seen
+            FROM workers ORDER BY started_at
+        """
+        ).fetchall()
+        failed = conn.execute(
+            "SELECT db_path, error FROM leases WHERE status = 'failed'"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    print(
+        "Leases: "
+        + ", ".join(f"{leases.get(status, 0)} {status}" for status in ("done", "leased", "pending", "failed"))
+    )
+    print(f"Results: {found} found, {missing} missing")
+    for db_path, error in failed:
+        print(f"Failed: {db_path} ({error})")
+    print(f"{'Worker':<32} {'Leases':>7} {'Items':>8} {'Misses':>7} {'Items/s':>8} {'Busy':>6}  Last seen")
+    for worker, lease_count, items, misses, busy_time, elapsed, last_seen in workers:
+        rate = items / busy_time if busy_time else 0
+        busy = busy_time / elapsed if elapsed else 0
+        print(
+            f"{worker:<32} {lease_count:>7} {items:>8} {misses:>7} {rate:>8.1f} {busy:>6.0%}  "
+            f"{datetime.fromtimestamp(last_seen).isoformat(sep=' ', timespec='seconds')}"
+        )
 
 
 # MAIN #############################################################################################
 def main():
     """
-    Execute scene or gallery lookup and print the result as JSON to stdout
+    Execute scene, gallery or image lookup and print the result as JSON to stdout
     """
+    if sys.argv[1] == "buildCatalog":
+        if len(sys.argv) < 3:
+            log.error("Usage: fanscrape.py buildCatalog <catalog_file> [search_path]")
+            sys.exit(1)
+        search_path = sys.argv[3] if len(sys.argv) > 3 else META_BASE_PATH
+        if not search_path:
+            log.error("No search path provided and 'meta_base_path' is not set")
+            sys.exit(1)
+        build_catalog(sys.argv[2], search_path)
+        sys.exit()
+
+    if sys.argv[1] == "buildFingerprints":
+        search_path = sys.argv[2] if len(sys.argv) > 2 else META_BASE_PATH
+        if not FINGERPRINT_INDEX or not search_path:
+            log.error("Set 'fingerprint_index' and 'meta_base_path' (or pass a search path)")
+            sys.exit(1)
+        build_fingerprint_index(FINGERPRINT_INDEX, search_path)
+        sys.exit()
+
+    if sys.argv[1] == "prefetchPaths":
+        prefetch_paths()
+        sys.exit()
+
+    if sys.argv[1] in ("queueJob", "worker", "queueStatus"):
+        if len(sys.argv) < 3:
+            log.error(f"Usage: fanscrape.py {sys.argv[1]} <queue_file>")
+            sys.exit(1)
+        if sys.argv[1] == "queueJob":
+            search_path = sys.argv[3] if len(sys.argv) > 3 else META_BASE_PATH
+            if not search_path:
+                log.error("No search path provided and 'meta_base_path' is not set")
+                sys.exit(1)
+            create_queue_job(sys.argv[2], search_path)
+        elif sys.argv[1] == "worker":
+            run_worker(sys.argv[2])
+        else:
+            print_queue_status(sys.argv[2])
+        sys.exit()
+
     fragment = json.loads(sys.stdin.read())
+
+    if sys.argv[1] == "searchPerformer":
+        print(json.dumps(search_performer(fragment["name"])))
+        sys.exit()
+    if sys.argv[1] == "queryPerformer":
+        print(json.dumps(scrape_performer(fragment)))
+        log.debug(f"Script runtime: total runtime: {time.monotonic() - START_TIME} seconds")
+        sys.exit()
+
     scrape_id = fragment["id"]
 
-    start_time = time.monotonic()
     if sys.argv[1] == "queryScene":
         lookup = lookup_scene
         if fragment.get("files", None) is not None:
@@ -844,23 +2567,35 @@ def main():
     elif sys.argv[1] == "queryGallery":
         lookup = lookup_gallery
         path = Path(get_gallery_path(scrape_id))
+    elif sys.argv[1] == "queryImage":
+        lookup = lookup_image
+        if fragment.get("files", None) is not None:
+            path = Path(fragment["files"][0]["path"])
+        else:
+            path = Path(get_image_path(scrape_id))
     else:
         log.error("Invalid argument(s) provided: " + str(sys.argv))
         print("null")
         sys.exit()
 
-    log.debug(
-        f"Script runtime: after scene path: {time.monotonic() - start_time} seconds"
-    )
+    if CATALOG:
+        media = lookup_catalog(path, sys.argv[1])
+        if media is not None:
+            print(json.dumps(media))
+            log.debug(
+                f"Script runtime: total runtime: {time.monotonic() - START_TIME} seconds"
+            )
+            sys.exit()
+
     username, network, media_dir = get_path_info(path)
-    log.debug(
-        f"Script runtime: after scene path: {time.monotonic() - start_time} seconds"
-    )
+    within_budget("path lookup")
 
-    db = get_metadata_db(path, username, network)
-    log.debug(
-        f"Script runtime: after metadata db: {time.monotonic() - start_time} seconds"
-    )
+    db = None
+    if lookup is lookup_image:
+        db = get_memoized_db(path.parent.resolve())
+    if db is None:
+        db = get_metadata_db(path, username, network)
+    within_budget("db discovery")
 
     if db is None:
         log.error("The db was not found, exiting.")
@@ -868,12 +2603,14 @@ def main():
         sys.exit()
 
     media = lookup(path, db, media_dir, username, network)
-    log.debug(
-        f"Script runtime: after media lookup: {time.monotonic() - start_time} seconds"
-    )
+    within_budget("media lookup")
+    if skipped_stages:
+        log.warning(
+            f"[BUDGET] Returning partial result, skipped: {', '.join(skipped_stages)}"
+        )
     print(json.dumps(media))
 
-    log.debug(f"Script runtime: total runtime: {time.monotonic() - start_time} seconds")
+    log.debug(f"Script runtime: total runtime: {time.monotonic() - START_TIME} seconds")
     sys.exit()
 
 
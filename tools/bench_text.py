@@ -0,0 +1,215 @@
+"""
+Microbenchmarks for the post text normalization (titles, details and mentions).
+
+Compares the current functions in 'fanscrape.py' with the previous implementation
+(kept below as reference), first checking that both produce the same titles, details
+and performer mentions for every caption.
+
+Usage (from the repository root):
+    python tools/bench_text.py --captions 2000 --media-per-post 4
+
+This script is a development tool and is not part of the installed scraper.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from html import unescape
+from pathlib import Path
+
+from markdown import Markdown
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from stress_harness import start_stub_stash  # noqa: E402
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+# REFERENCE ########################################################################################
+reference_md = None
+
+
+def reference_sanitize_string(string):
+    if string:
+        string = unescape(string).replace("<br /> ", "\n")
+        string = re.sub(r"<[^>]*>", "", string)
+        return string
+    return string
+
+
+def reference_format_title(title, username, date, scene_index, scene_count, max_length, truncate):
+    if len(title) == 0:
+        scene_info = f" ({scene_index})" if scene_index > 0 else ""
+        return f"{username} - {date}{scene_info}"
+
+    title = reference_sanitize_string(title)
+    title = reference_md.convert(title)
+
+    f_title = truncate(title.split("\n")[0].strip(), max_length)
+    scene_info = f" ({scene_index})" if scene_index > 0 else ""
+
+    if len(f_title) <= 5:
+        return f"{f_title} - {date}{scene_info}"
+
+    if not bool(re.search("[A-Za-z0-9]", f_title)):
+        if scene_index == 0:
+            title_max_len = max_length - 13
+        else:
+            title_max_len = max_length - 16 - len(str(scene_index))
+        t_title = truncate(f_title, title_max_len)
+        return f"{t_title} - {date}{scene_info}"
+
+    scene_info = f" {scene_index}/{scene_count}" if scene_index > 0 else ""
+    return f"{f_title}{scene_info}"
+
+
+def reference_search_performers(scene):
+    pattern = re.compile(r"(?:^|\s)@([\w\-\.]+)")
+    content = unescape(scene["details"])
+    if scene["title"].endswith("..") and scene["title"].removesuffix("..") in content:
+        searchtext = content
+    else:
+        searchtext = scene["title"] + " " + content
+    return re.findall(pattern, unescape(searchtext))
+
+
+# CORPUS ###########################################################################################
+PLAIN_WORDS = ["new", "video", "today", "thank", "you", "all", "for", "the", "love", "❤️", "🔥", "so", "much", "fun"]
+MARKUP = ["**bold**", "_soft_", "`code`", "[link](https://example.com)", "<b>html</b>", "&amp;", "<br /> ", "# Big", "- item", "\x02"]
+LINE_ENDINGS = ["\n", "\n", "\n", "\r\n", "\r"]
+
+
+def make_caption(markdown_ratio):
+    """
+    Build a synthetic post caption, with markdown or HTML in about markdown_ratio of them.
+    """
+    words = [random.choice(PLAIN_WORDS) for _ in range(random.randint(3, 60))]
+    if random.random() < 0.3:
+        words.insert(random.randint(0, len(words)), f"@creator{random.randint(0, 50)}")
+    if random.random() < markdown_ratio:
+        words.insert(random.randint(0, len(words)), random.choice(MARKUP))
+    lines = [" ".join(words)]
+    if random.random() < 0.5:
+        lines.append(" ".join(random.choice(PLAIN_WORDS) for _ in range(10)))
+    # captions from some clients use CR or CRLF line endings
+    return random.choice(LINE_ENDINGS).join(lines)
+
+
+def make_rows(captions, media_per_post, markdown_ratio):
+    """
+    Build (row, filename, scene_index, scene_count) tuples, media of a post sharing its caption.
+    """
+    rows = []
+    for post_id in range(captions):
+        text = make_caption(markdown_ratio)
+        created_at = datetime(2023, 1 + post_id % 12, 1 + post_id % 28)
+        count = media_per_post if media_per_post > 1 else 0
+        for index in range(media_per_post):
+            row = (post_id, text, created_at, f"https://cdn.example.com/{post_id}_{index}.mp4", None)
+            rows.append((row, f"{post_id}_{index}.mp4", index + 1 if count else 0, count))
+    return rows
+
+
+# MAIN #############################################################################################
+def import_fanscrape():
+    """
+    Import fanscrape.py against a stub Stash, from a temporary working directory.
+    """
+    server = start_stub_stash(0.0)
+    workdir = Path(tempfile.mkdtemp(prefix="fanscrape-bench-"))
+    with open(workdir / "config.json", "w", encoding="utf-8") as file:
+        json.dump(
+            {"stash_connection": {"scheme": "http", "host": "127.0.0.1", "port": server.server_address[1]}},
+            file,
+        )
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_ROOT))
+    fanscrape = importlib.import_module("fanscrape")
+
+    # separate parser for the reference, using the "plain" output format registered by fanscrape
+    global reference_md
+    reference_md = Markdown(output_format="plain")
+    reference_md.stripTopLevelTags = False
+    return fanscrape
+
+
+def bench(name, func, number):
+    """
+    Time func and print the best of three runs.
+    """
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"{name:<48} {seconds * 1000:10.3f} ms")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--captions", type=int, default=2000, help="number of distinct post captions")
+    parser.add_argument("--media-per-post", type=int, default=4, help="media sharing each caption")
+    parser.add_argument("--markdown-ratio", type=float, default=0.2, help="share of captions with markup")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    fanscrape = import_fanscrape()
+    rows = make_rows(args.captions, args.media_per_post, args.markdown_ratio)
+    username, date, max_length = "creator", "2023-10-16", fanscrape.MAX_TITLE_LENGTH
+
+    def reference_titles():
+        return [
+            reference_format_title(row[1], username, date, index, count, max_length, fanscrape.truncate_title)
+            for row, _, index, count in rows
+        ]
+
+    def current_titles():
+        return [fanscrape.format_title(row[1], username, date, index, count) for row, _, index, count in rows]
+
+    def clear_caches():
+        fanscrape.sanitize_string.cache_clear()
+        fanscrape.get_title_line.cache_clear()
+
+    # correctness
+    mismatches = 0
+    for reference, current, (row, _, _, _) in zip(reference_titles(), current_titles(), rows):
+        details = fanscrape.sanitize_string(row[1])
+        scene = {"title": current, "details": details}
+        if (
+            reference != current
+            or details != reference_sanitize_string(row[1])
+            or reference_search_performers(scene) != fanscrape.searchPerformers(scene)
+        ):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"MISMATCH {row[1]!r}: {reference!r} != {current!r}")
+    print(f"{len(rows)} rows ({args.captions} captions), {mismatches} mismatch(es)\n")
+
+    bench("reference format_title", reference_titles, 1)
+    bench("format_title (cold cache)", lambda: (clear_caches(), current_titles()), 1)
+    bench("format_title (warm cache)", current_titles, 1)
+    bench(
+        "reference searchPerformers",
+        lambda: [reference_search_performers({"title": "title", "details": row[1]}) for row, *_ in rows],
+        1,
+    )
+    bench(
+        "searchPerformers",
+        lambda: [fanscrape.searchPerformers({"title": "title", "details": row[1]}) for row, *_ in rows],
+        1,
+    )
+    bench(
+        "process_row loop (cold cache)",
+        lambda: (clear_caches(), [fanscrape.process_row(r, username, "OnlyFans", *rest) for r, *rest in rows]),
+        1,
+    )
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,569 @@
+"""
+Load-test harness simulating Stash running many FanScrape scrapes in parallel.
+
+Builds a synthetic library of creator 'user_data.db' files, starts a local stub of the
+Stash GraphQL endpoint and launches concurrent 'fanscrape.py' invocations against it
+(scene, gallery, image and performer scrapes), the same way Stash does during Identify
+or bulk scrapes.
+
+For each parallelism level it reports latency percentiles, throughput, peak RSS and
+block I/O of the scraper processes, and checks the shared state ('config.json',
+'cache.json', the files in 'cache_dir' and temporary database copies) for corruption.
+
+Usage (from the repository root):
+    python tools/stress_harness.py --parallel 1,4,16 --scrapes 200
+
+This script is a development tool and is not part of the installed scraper.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FANSCRAPE = Path(__file__).resolve().parent.parent / "fanscrape.py"
+
+API_TYPES = ["Posts", "Stories", "Messages", "Products", "Others"]
+
+
+# LIBRARY ##########################################################################################
+def write_image(path, size=16):
+    """
+    Write a small PNG with random pixels, so performer images have real content to encode.
+    """
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + random.randbytes(size * 3) for _ in range(size))
+    path.write_bytes(
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+def create_user_db(db_file, media_dir, username, posts, videos, images, text_length):
+    """
+    Create a synthetic 'user_data.db' in the DIGITALCRIMINAL/OF-Scraper schema and touch its media files.
+
+    Returns a list of (kind, path) tuples for every media file.
+    """
+    db_file.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_file)
+    c = conn.cursor()
+    c.executescript(
+        """
+        CREATE TABLE medias (
+            id INTEGER PRIMARY KEY, media_id INTEGER, post_id INTEGER, link TEXT,
+            directory TEXT, filename TEXT, size INTEGER, api_type TEXT, media_type TEXT,
+            preview INTEGER, linked TEXT, downloaded INTEGER, created_at TIMESTAMP
+        );
+        """
+    )
+    for table in API_TYPES:
+        c.execute(
+            f"""
+            CREATE TABLE {table.lower()} (
+                id INTEGER PRIMARY KEY, post_id INTEGER, text TEXT, price INTEGER,
+                paid INTEGER, archived INTEGER, created_at TIMESTAMP
+            )
+        """
+        )
+
+    words = ["lorem", "ipsum", "**dolor**", "sit", "amet", "<br />", "@friend", "_elit_"]
+    media_files = []
+    media_id = 0
+    for post_index in range(posts):
+        post_id = 100000 + post_index
+        api_type = API_TYPES[post_index % len(API_TYPES)]
+        text = " ".join(random.choice(words) for _ in range(text_length // 6))
+        created_at = f"2023-{post_index % 12 + 1:02d}-{post_index % 28 + 1:02d}T12:00:00"
+        c.execute(
+            f"INSERT INTO {api_type.lower()} (post_id, text, created_at) VALUES (?, ?, ?)",
+            (post_id, text, created_at),
+        )
+        post_dir = media_dir / api_type / str(post_id)
+        post_dir.mkdir(parents=True, exist_ok=True)
+        for media_type, count, ext in (("Videos", videos, "mp4"), ("Images", images, "jpg")):
+            for _ in range(count):
+                media_id += 1
+                filename = f"{post_id}_{media_id}.{ext}"
+                if media_type == "Images":
+                    write_image(post_dir / filename)
+                else:
+                    (post_dir / filename).touch()
+                c.execute(
+                    """
+                    INSERT INTO medias (media_id, post_id, link, directory, filename,
+                    api_type, media_type, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                    (
+                        media_id,
+                        post_id,
+                        f"https://cdn.example.com/files/{media_id}_source.{ext}?sig=1",
+                        str(post_dir.resolve()),
+                        filename,
+                        api_type,
+                        media_type,
+                        created_at,
+                    ),
+                )
+                media_files.append((media_type, post_dir / filename))
+    conn.commit()
+    conn.close()
+    return media_files
+
+
+def create_library(root, creators, posts, videos, images, text_length):
+    """
+    Create a synthetic library with one metadata database per creator.
+
+    Half of the creators get an avatar and header in their 'Profile' directory, the others
+    use images picked at random from their media as performer images.
+
+    Returns the media files, and the creators as (network, username, has_profile) tuples.
+    """
+    media_files, creator_list = [], []
+    for index in range(creators):
+        network = "OnlyFans" if index % 2 == 0 else "Fansly"
+        username = f"creator{index}"
+        creator_dir = root / network / username
+        has_profile = index % 4 in (1, 2)
+        if has_profile:
+            for kind in ("Avatars", "Headers"):
+                (creator_dir / "Profile" / kind).mkdir(parents=True, exist_ok=True)
+                write_image(creator_dir / "Profile" / kind / f"{kind[:-1].lower()}.jpg", 64)
+        creator_list.append((network, username, has_profile))
+        media_files += create_user_db(
+            creator_dir / "Metadata" / "user_data.db",
+            creator_dir,
+            username,
+            posts,
+            videos,
+            images,
+            text_length,
+        )
+    return media_files, creator_list
+
+
+# STUB STASH #######################################################################################
+def object_type(name, fields):
+    """
+    Build a minimal introspection entry for an object type, used by stashapi to generate fragments.
+    """
+    return {
+        "kind": "OBJECT",
+        "name": name,
+        "fields": [
+            {"name": field, "type": {"kind": kind, "name": type_name}}
+            for field, kind, type_name in fields
+        ],
+    }
+
+
+SCHEMA_TYPES = [
+    object_type("Scene", [("id", "SCALAR", "ID"), ("files", "OBJECT", "VideoFile")]),
+    object_type("VideoFile", [("path", "SCALAR", "String")]),
+    object_type("Gallery", [("id", "SCALAR", "ID"), ("folder", "OBJECT", "GalleryFolder")]),
+    object_type("GalleryFolder", [("path", "SCALAR", "String")]),
+    object_type("Image", [("id", "SCALAR", "ID"), ("visual_files", "OBJECT", "ImageFile")]),
+    object_type("ImageFile", [("path", "SCALAR", "String")]),
+    object_type("Performer", [("id", "SCALAR", "ID"), ("name", "SCALAR", "String")]),
+]
+
+
+class StubStash(BaseHTTPRequestHandler):
+    """
+    Answer the GraphQL queries FanScrape sends with canned responses.
+    """
+
+    paths = {}
+    latency = 0.0
+    requests = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    @staticmethod
+    def find_page(kind, variables):
+        """
+        Answer a paginated findScenes/findGalleries query from the registered paths.
+        """
+        items = sorted(
+            (int(item_id), path) for (item_kind, item_id), path in StubStash.paths.items() if item_kind == kind
+        )
+        page, per_page = variables["filter"]["page"], variables["filter"]["per_page"]
+        items = [
+            {"id": str(item_id), "files": [{"path": path}], "folder": {"path": path}}
+            for item_id, path in items
+        ]
+        key = "scenes" if kind == "scene" else "galleries"
+        result = {"count": len(items), key: items[(page - 1) * per_page : page * per_page]}
+        return {f"find{key.capitalize()}": result}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        query = body.get("query", "")
+        variables = body.get("variables", {})
+        with StubStash.lock:
+            StubStash.requests += 1
+        if StubStash.latency:
+            time.sleep(StubStash.latency)
+
+        if "StashVersion" in query:
+            data = {"version": {"version": "v0.27.0", "hash": "abcdef123", "build_time": ""}}
+        elif "getApiKey" in query:
+            data = {"configuration": {"general": {"apiKey": ""}}}
+        elif "__schema" in query:
+            data = {"__schema": {"types": SCHEMA_TYPES}}
+        elif "findScenes" in query or "findGalleries" in query:
+            data = StubStash.find_page("scene" if "findScenes" in query else "gallery", variables)
+        elif "findScene" in query:
+            path = StubStash.paths.get(("scene", str(variables.get("scene_id"))))
+            data = {"findScene": {"files": [{"path": path}]} if path else None}
+        elif "findGallery" in query:
+            path = StubStash.paths.get(("gallery", str(variables.get("id"))))
+            data = {"findGallery": {"folder": {"path": path}} if path else None}
+        elif "findImage" in query:
+            path = StubStash.paths.get(("image", str(variables.get("id"))))
+            data = {"findImage": {"visual_files": [{"path": path}]} if path else None}
+        elif "findPerformers" in query:
+            data = {"findPerformers": {"count": 0, "performers": []}}
+        elif "findStudios" in query:
+            data = {"findStudios": {"count": 0, "studios": []}}
+        else:
+            data = {}
+
+        response = json.dumps({"data": data}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+
+def start_stub_stash(latency):
+    """
+    Start the stub Stash server on a free local port in a background thread.
+    """
+    StubStash.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubStash)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# INVOCATIONS ######################################################################################
+def build_jobs(media_files, creators, scrapes, with_files, performer_ratio):
+    """
+    Build scrape jobs as (action, fragment) tuples and register their paths with the stub.
+
+    Also returns the ids of the performer scrapes whose images are picked at random.
+    """
+    jobs, random_images = [], set()
+    for index in range(scrapes):
+        media_type, path = random.choice(media_files)
+        scrape_id = str(index + 1)
+        if random.random() < performer_ratio:
+            network, username, has_profile = random.choice(creators)
+            if index % 2:
+                jobs.append(("searchPerformer", {"name": username}))
+            else:
+                url = f"https://{network.lower()}.com/{username}"
+                jobs.append(("queryPerformer", {"id": scrape_id, "name": username, "urls": [url]}))
+                if not has_profile:
+                    random_images.add(scrape_id)
+            jobs[-1][1]["id"] = scrape_id
+            continue
+        if media_type == "Videos":
+            action, kind = "queryScene", "scene"
+        elif index % 2:
+            action, kind = "queryImage", "image"
+        else:
+            action, kind, path = "queryGallery", "gallery", path.parent
+        StubStash.paths[(kind, scrape_id)] = str(path)
+        fragment = {"id": scrape_id}
+        if with_files and kind != "gallery":
+            fragment["files"] = [{"path": str(path)}]
+        jobs.append((action, fragment))
+    return jobs, random_images
+
+
+def run_scrape(workdir, tmpdir, action, fragment):
+    """
+    Run a single 'fanscrape.py' invocation and collect its output and resource usage.
+    """
+    env = dict(os.environ, TMPDIR=str(tmpdir))
+    log_file = workdir / "logs" / f"{action}-{fragment['id']}-{time.monotonic_ns()}.log"
+    start = time.monotonic()
+    with open(log_file, "wb") as stderr:
+        proc = subprocess.Popen(
+            [sys.executable, str(FANSCRAPE), action],
+            cwd=workdir,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+        )
+        proc.stdin.write(json.dumps(fragment).encode("utf-8"))
+        proc.stdin.close()
+        output = proc.stdout.read()
+        proc.stdout.close()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "action": action,
+        "id": fragment["id"],
+        "latency": time.monotonic() - start,
+        "returncode": proc.returncode,
+        "output": output.decode("utf-8", "replace").strip(),
+        "maxrss_kb": rusage.ru_maxrss,
+        "blocks_in": rusage.ru_inblock,
+        "blocks_out": rusage.ru_oublock,
+        "log": log_file,
+    }
+
+
+def percentile(values, pct):
+    """
+    Return the nearest-rank percentile of a list of values.
+    """
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+# INTEGRITY ########################################################################################
+def check_shared_state(workdir, tmpdir, config):
+    """
+    Check the files shared between concurrent invocations for corruption or lost entries.
+    """
+    problems = []
+
+    try:
+        with open(workdir / "config.json", "r", encoding="utf-8") as file:
+            written = json.load(file)
+        missing = [key for key in config if key not in written]
+        if missing:
+            problems.append(f"config.json lost key(s): {missing}")
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        problems.append(f"config.json is corrupted: {e}")
+
+    cache_dir = workdir / config["cache_dir"]
+    cache_file = workdir / config["cache_file"]
+    referenced = set()
+    if cache_file.exists():
+        try:
+            with open(cache_file, "r", encoding="utf-8") as file:
+                cache = json.load(file)
+            for path, (_, image_filenames) in cache.items():
+                for image_filename in image_filenames:
+                    referenced.add(image_filename)
+                    image_path = cache_dir / image_filename
+                    if not image_path.is_file() or image_path.stat().st_size == 0:
+                        problems.append(f"cache.json entry {path} lost {image_filename}")
+        except (json.JSONDecodeError, ValueError) as e:
+            problems.append(f"cache.json is corrupted: {e}")
+
+    if cache_dir.exists():
+        for profile_file in cache_dir.glob("*.profile.json"):
+            try:
+                with open(profile_file, "r", encoding="utf-8") as file:
+                    profile = json.load(file)
+                if not profile["images"] or not all(profile["images"]):
+                    problems.append(f"{profile_file.name} has no or empty images")
+            except (json.JSONDecodeError, KeyError) as e:
+                problems.append(f"{profile_file.name} is corrupted: {e}")
+        for b64_file in cache_dir.glob("*.b64"):
+            if b64_file.name not in referenced:
+                problems.append(f"orphaned cache file: {b64_file.name}")
+        for memo_file in cache_dir.glob("*.json"):
+            try:
+                with open(memo_file, "r", encoding="utf-8") as file:
+                    json.load(file)
+            except json.JSONDecodeError as e:
+                problems.append(f"{memo_file.name} is corrupted: {e}")
+
+    leftovers = list(tmpdir.iterdir())
+    if leftovers:
+        problems.append(f"{len(leftovers)} temporary file(s) left behind in {tmpdir}")
+
+    return problems
+
+
+def normalize_output(output, random_images=False):
+    """
+    Parse a scrape result, sorting the performers since their order is not stable between runs.
+
+    Performer images picked at random are only compared by count.
+    """
+    try:
+        scrape = json.loads(output)
+    except json.JSONDecodeError:
+        return output
+    if isinstance(scrape, dict) and "Performers" in scrape:
+        scrape["Performers"] = sorted(scrape["Performers"], key=lambda p: p["Name"])
+    if random_images and isinstance(scrape, dict):
+        scrape["images"] = len(scrape.get("images") or [])
+    return scrape
+
+
+def check_results(results, expected, random_images):
+    """
+    Compare concurrent results with the serial baseline, returning a list of problems.
+    """
+    problems = []
+    for result in results:
+        key = (result["action"], result["id"])
+        output = normalize_output(result["output"], result["id"] in random_images)
+        if result["returncode"] != 0:
+            problems.append(f"{key} exited with {result['returncode']} (see {result['log']})")
+        elif output != expected.get(key):
+            problems.append(f"{key} returned a different result (see {result['log']})")
+    return problems
+
+
+# MAIN #############################################################################################
+def run_level(workdir, tmpdir, jobs, parallel):
+    """
+    Run all jobs with the given number of concurrent invocations.
+    """
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        results = list(
+            pool.map(lambda job: run_scrape(workdir, tmpdir, job[0], job[1]), jobs)
+        )
+    return results, time.monotonic() - start
+
+
+def report(parallel, results, elapsed, problems):
+    """
+    Print the statistics for one parallelism level.
+    """
+    latencies = [result["latency"] for result in results]
+    print(
+        f"parallel={parallel:<4} scrapes={len(results):<5} "
+        f"p50={percentile(latencies, 50):.3f}s p99={percentile(latencies, 99):.3f}s "
+        f"throughput={len(results) / elapsed:.1f}/s "
+        f"peak_rss={max(r['maxrss_kb'] for r in results) / 1024:.1f}MiB "
+        f"blocks_in={sum(r['blocks_in'] for r in results)} "
+        f"blocks_out={sum(r['blocks_out'] for r in results)} "
+        f"problems={len(problems)}"
+    )
+    for problem in problems[:20]:
+        print(f"    {problem}")
+    if len(problems) > 20:
+        print(f"    ... and {len(problems) - 20} more")
+
+
+def write_config(workdir, config):
+    """
+    Write a fresh 'config.json', so each parallelism level starts from an intact config.
+    """
+    with open(workdir / "config.json", "w", encoding="utf-8") as file:
+        json.dump(config, file, indent=2)
+
+
+def main():
+    """
+    Build the synthetic library, then run the scrapes for every parallelism level.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--parallel", default="1,4,8,16", help="comma separated parallelism levels")
+    parser.add_argument("--scrapes", type=int, default=100, help="scrapes per parallelism level")
+    parser.add_argument("--creators", type=int, default=4)
+    parser.add_argument("--posts", type=int, default=500, help="posts per creator")
+    parser.add_argument("--videos", type=int, default=2, help="videos per post")
+    parser.add_argument("--images", type=int, default=4, help="images per post")
+    parser.add_argument("--text-length", type=int, default=300, help="characters per post text")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub Stash latency per request (s)")
+    parser.add_argument("--with-files", action="store_true", help="include file paths in fragments")
+    parser.add_argument("--performer-ratio", type=float, default=0.2, help="share of performer scrapes")
+    parser.add_argument("--prefetch", action="store_true", help="prefetch scene/gallery paths before each level")
+    parser.add_argument("--warm", action="store_true", help="keep caches between parallelism levels")
+    parser.add_argument("--config", type=json.loads, default={}, help="extra config.json values (JSON)")
+    parser.add_argument("--workdir", type=Path, help="keep the library and logs in this directory")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="fanscrape-stress-"))
+    workdir = workdir.resolve()
+    (workdir / "logs").mkdir(parents=True, exist_ok=True)
+    tmpdir = workdir / "tmp"
+    tmpdir.mkdir(exist_ok=True)
+
+    print(f"Building library in {workdir}")
+    media_files, creators = create_library(
+        workdir / "library", args.creators, args.posts, args.videos, args.images, args.text_length
+    )
+    server = start_stub_stash(args.latency)
+
+    config = {
+        "stash_connection": {
+            "scheme": "http",
+            "host": "127.0.0.1",
+            "port": server.server_address[1],
+            "apikey": "",
+        },
+        "cache_dir": "cache",
+        "cache_file": "cache.json",
+        "meta_base_path": str(workdir / "library"),
+    }
+    config.update(args.config)
+    write_config(workdir, config)
+
+    jobs, random_images = build_jobs(
+        media_files, creators, args.scrapes, args.with_files, args.performer_ratio
+    )
+
+    # serial baseline, used to detect wrong results under concurrency
+    baseline, _ = run_level(workdir, tmpdir, jobs, 1)
+    expected = {
+        (r["action"], r["id"]): normalize_output(r["output"], r["id"] in random_images)
+        for r in baseline
+    }
+    failed = [r for r in baseline if r["returncode"] != 0 or r["output"] in ("", "null")]
+    if failed:
+        print(f"{len(failed)} scrape(s) failed in the serial baseline, e.g. {failed[0]['log']}")
+
+    exit_code = 0
+    for parallel in [int(level) for level in args.parallel.split(",")]:
+        write_config(workdir, config)
+        if not args.warm:
+            shutil.rmtree(workdir / config["cache_dir"], ignore_errors=True)
+            (workdir / config["cache_file"]).unlink(missing_ok=True)
+        requests_before = StubStash.requests
+        if args.prefetch:
+            subprocess.run([sys.executable, str(FANSCRAPE), "prefetchPaths"], cwd=workdir, stderr=subprocess.DEVNULL)
+        results, elapsed = run_level(workdir, tmpdir, jobs, parallel)
+        problems = check_results(results, expected, random_images) + check_shared_state(
+            workdir, tmpdir, config
+        )
+        report(parallel, results, elapsed, problems)
+        print(f"    stash requests: {StubStash.requests - requests_before}")
+        if problems:
+            exit_code = 1
+
+    server.shutdown()
+    print(f"Library and logs kept in {workdir}")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()